@@ -7,7 +7,9 @@ import datetime
 import subprocess
 import numpy as np
 import pandas as pd
+from functools import partial
 from typing import Union, List, Dict
+from .multi_processor_util import parall_fun
 
 
 def parse_path_list(paths: Union[str, List[str]]) -> List[str]:
@@ -108,6 +110,20 @@ def plot_history(history: Dict[str, List[Union[float, int, str]]], plot_keys_lis
     print(f"metrics has been saved in '{path}'")
 
 
+def compile_key_path(keys: str) -> tuple:
+    """把"a->b->c"形式的key路径预编译为("a", "b", "c")，避免每条记录重复切分字符串
+    """
+    return tuple(k.strip() for k in keys.split("->"))
+
+
+def read_key_path(input_dict: dict, key_path: tuple):
+    """按compile_key_path编译后的路径读取嵌套字典，行为与recurrent_read_dict一致
+    """
+    for key in key_path[:-1]:
+        input_dict = input_dict[key]
+    return input_dict[key_path[-1]] if key_path[-1] in input_dict else ""
+
+
 def recurrent_read_dict(input_dict: dict, keys: str):
     """
     循环解析并读嵌套取字典key
@@ -117,29 +133,33 @@ def recurrent_read_dict(input_dict: dict, keys: str):
             [out] {'aa': {'aaa': {'aaa': 2, 'bbb': 3}}}
         >>> recurrent_read_dict(a, "a->aa->aaa->bbbb")
             [out] 3
+        - 20240227更新，支持最后一个key不存在，返回空，但是不能支持中间的某个key不存在。
     """
-    tmp_key, past_key = keys.split("->")[0].strip(), "->".join(keys.split("->")[1:]).strip()
-    if past_key:
-        return recurrent_read_dict(input_dict[tmp_key], past_key)
-    else:
-        if tmp_key not in input_dict:
-            # 20240227更新，支持最后一个key不存在，返回空，但是不能支持中间的某个key不存在。
-            return ""
-        else:
-            return input_dict[tmp_key]
+    return read_key_path(input_dict, compile_key_path(keys))
 
 
 def read_gpt_res(path, keys_map):
-    gpt_res = [json.loads(line) for line in open(path)]
-    gpt_res_df = pd.DataFrame([
-        {k: recurrent_read_dict(line, v) for k, v in keys_map.items()} for line in gpt_res
-    ])
-    return gpt_res_df
-
-
-def read_gpt_res_list(path, keys_map):
+    """
+    逐行读取jsonl，按keys_map抽取字段直接写入列，不保留原始dict，大文件内存只和抽取的列有关
+        - keys_map: {列名: "a->b->c"形式的key路径}，路径只编译一次
+    """
+    key_paths = [(k, compile_key_path(v)) for k, v in keys_map.items()]
+    columns = {k: [] for k, _ in key_paths}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for k, key_path in key_paths:
+                columns[k].append(read_key_path(record, key_path))
+    return pd.DataFrame(columns)
+
+
+def read_gpt_res_list(path, keys_map, thread=8, backend="process"):
     """
     path - 路径列表，支持读取多条路径
+    thread - 并行读取的文件数
+    backend - 并行方式，默认process，json解析是CPU密集的，见parall_fun
     """
     if path and isinstance(path, str) and os.path.exists(path):
         path_list = [path]
@@ -149,7 +169,11 @@ def read_gpt_res_list(path, keys_map):
         raise Exception(f"[ERROR] Unknown type={type(path)}")
 
     if path_list:
-        return pd.concat([read_gpt_res(path, keys_map) for path in path_list])
+        k = min(thread, len(path_list))
+        if k <= 1:
+            return pd.concat([read_gpt_res(path, keys_map) for path in path_list])
+        dfs = parall_fun(partial(read_gpt_res, keys_map=keys_map), path_list, k, schedule="dynamic" if backend == "thread" else "static", backend=backend, progress=False)
+        return pd.concat(dfs)
     else:
         raise Exception("No matching file!")
 
@@ -169,26 +193,57 @@ def activate_hadoop_env(script: str = "/UserData/program/bashrc"):
     print("HDFS:", os.environ.get(""))
 
 
-def sample_querys(query_path, sample_nums):
-    df = pd.read_csv(query_path, sep="\t", usecols=[0], name=["query"])
-    df_sample = df.drop_dulicates().sample(sample_nums).reset_index(drop=True)
+def sample_querys(query_path, sample_nums, seed=0):
+    """query文件第一列流式去重后抽样sample_nums条，保存到query_path + ".sample"
+    """
+    from .read_util import read_df
+    df = read_df(query_path, header=None, dedup_on=[0])[[0]].rename(columns={0: "query"})
+    df_sample = df.sample(min(sample_nums, len(df)), random_state=seed).reset_index(drop=True)
     df_sample.to_csv(query_path + ".sample", sep="\t", index=False, header=None)
 
 
-def dropkey(x, keys):
-    fathers, res_key = keys.split(".")[:-1], keys.split(".")[-1]
-    for key in fathers:
-        if key in x:
+def compile_dot_path(keys) -> tuple:
+    """把"a.b.c"形式的key路径预编译为("a", "b", "c")，已编译的tuple原样返回
+    """
+    return keys if isinstance(keys, tuple) else tuple(keys.split("."))
+
+
+def drop_key_path(x, key_path: tuple):
+    for key in key_path[:-1]:
+        if isinstance(x, dict) and key in x:
             x = x[key]
         else:
             return False
-    if res_key in x:
-        x.pop(res_key)
+    if isinstance(x, dict) and key_path[-1] in x:
+        x.pop(key_path[-1])
         return True
     else:
         return False
 
 
+def keep_key_paths(x, key_paths: List[tuple]):
+    """只保留key_paths中的字段，返回新的dict，不存在的路径忽略
+    """
+    res = {}
+    for key_path in key_paths:
+        src, dst = x, res
+        for key in key_path[:-1]:
+            if not isinstance(src, dict) or key not in src:
+                break
+            src = src[key]
+            if not isinstance(dst.get(key), dict):
+                dst[key] = {}
+            dst = dst[key]
+        else:
+            if isinstance(src, dict) and key_path[-1] in src:
+                dst[key_path[-1]] = src[key_path[-1]]
+    return res
+
+
+def dropkey(x, keys):
+    return drop_key_path(x, compile_dot_path(keys))
+
+
 def dropkeys(x, keys):
     for k in keys:
         dropkey(x, k)
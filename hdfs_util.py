@@ -1,30 +1,130 @@
 import os
+import shutil
 import pandas as pd
 import pandas._libs.lib as lib
+from .multi_processor_util import parall_fun
 
 
 # hdfs_cmd = "{}bin/hdfs".format(os.environ.get('HADOOP_HOME')) if 'HADOOP_HOME' in os.environ else "hdfs"
 hdfs_cmd = "hdfs"
 
 
-def download_file(hdfs_file, local_file, redownload=False, merge=True):
+def get_file_signature(hdfs_file):
+    """用一次`hdfs dfs -ls`得到远端文件（或目录下所有文件）的size和修改时间，作为是否变化的依据，文件不存在返回空串
+    """
+    return "\n".join(sorted(["{} {} {}".format(i["path"], i["size"], i["mtime"]) for i in ls_hdfs(hdfs_file)]))
+
+
+def signature_file(local_file):
+    return os.path.join(os.path.dirname(local_file), "." + os.path.basename(local_file) + ".hdfs_sign")
+
+
+def save_local_signature(signature, local_file):
+    """将远端文件签名存储成隐藏文件
+    """
+    with open(signature_file(local_file), "w") as f:
+        f.write(signature)
+
+
+def read_local_signature(local_file):
+    sign_file = signature_file(local_file)
+    return open(sign_file).read() if os.path.exists(sign_file) else ""
+
+
+def download_file(hdfs_file, local_file, redownload=False, merge=True, thread=1):
+    """
+    下载hdfs文件或目录，会同时保存远端的size和修改时间，本地已存在且远端没有变化时不下载
+        - merge: True使用getmerge将目录合并成一个文件，否则使用get
+        - thread: 大于1且merge时，使用download_dir并行下载目录下的part文件再按顺序合并
+    Returns:
+        是否发生了下载，1 or 0
+    """
     opt = "getmerge" if merge else "get"
-    if os.path.exists(local_file) and not redownload:
-        print("[WARNING] Local file {} exist, do not download.".format(local_file))
+    remote_sign = get_file_signature(hdfs_file)
+    if not remote_sign:
+        raise FileNotFoundError("[ERROR] File dose not exist! hdfs file: {}".format(hdfs_file))
+    if os.path.exists(local_file) and not redownload and read_local_signature(local_file) == remote_sign:
+        print("[INFO] Remote hdfs file '{}' dose not change, do not download.".format(hdfs_file))
+        return 0
+    if merge and thread > 1:
+        download_dir(hdfs_file, local_file, thread=thread)
     else:
+        if not merge and os.path.exists(local_file):
+            shutil.rmtree(local_file) if os.path.isdir(local_file) else os.remove(local_file)
         if os.system("{} dfs -{} {} {}".format(hdfs_cmd, opt, hdfs_file, local_file)):
             raise Exception("[ERROR] Downlaod failed! hdfs file: {}".format(hdfs_file))
         else:
             print("[INFO] Download success! local file: {}".format(local_file))
+    save_local_signature(remote_sign, local_file)
+    return 1
 
 
-def download_file_list(hdfs_root, file_list, local_root, redownload=False, merge=True):
-    for file_name in file_list:
+def download_file_list(hdfs_root, file_list, local_root, redownload=False, merge=True, thread=1):
+    """thread大于1时多个文件并行下载
+    """
+    def download_one(file_name):
         hdfs_file = os.path.join(hdfs_root, file_name)
         local_file = os.path.join(local_root, file_name)
         download_file(hdfs_file, local_file, redownload, merge)
 
-    
+    if thread > 1 and len(file_list) > 1:
+        parall_fun(download_one, file_list, min(thread, len(file_list)))
+    else:
+        for file_name in file_list:
+            download_one(file_name)
+
+
+def ls_hdfs(hdfs_path):
+    """一次`hdfs dfs -ls`，返回[{"path", "size", "mtime", "is_dir"}]，hdfs_path为文件时只返回该文件本身
+    """
+    x = os.popen("{} dfs -ls '{}'".format(hdfs_cmd, hdfs_path)).read()
+    res = []
+    for line in x.split("\n"):
+        arr = line.split()
+        if len(arr) < 8 or arr[0][0] not in "d-":
+            continue
+        res.append({"path": " ".join(arr[7:]), "size": int(arr[4]), "mtime": arr[5] + " " + arr[6], "is_dir": arr[0][0] == "d"})
+    return res
+
+
+def list_part_files(hdfs_dir):
+    """列出目录下的数据文件，按路径排序，忽略子目录以及`_`、`.`开头的文件（_SUCCESS等）
+    """
+    return sorted([
+        i["path"] for i in ls_hdfs(hdfs_dir) 
+        if not i["is_dir"] and not os.path.basename(i["path"]).startswith(("_", "."))
+    ])
+
+
+def download_dir(hdfs_dir, local_file, thread=16):
+    """
+    并行下载hdfs目录，替代单流的getmerge：
+        - 列出所有part文件，切分成thread批，每批只启动一次`hdfs dfs -get`（一个JVM），多批并行
+        - 下载完成后按文件名顺序拼接成local_file，拼接后立即删除part文件
+    """
+    part_files = list_part_files(hdfs_dir)
+    if not part_files:
+        raise Exception("[ERROR] No part file found in hdfs dir: {}".format(hdfs_dir))
+    tmp_dir = os.path.join(os.path.dirname(local_file), "." + os.path.basename(local_file))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    def get_batch(batch):
+        if os.system("{} dfs -get {} '{}'".format(hdfs_cmd, " ".join(["'{}'".format(i) for i in batch]), tmp_dir)):
+            raise Exception("[ERROR] Downlaod failed! hdfs files: {}".format(batch))
+        return batch
+
+    parall_fun(get_batch, part_files, min(thread, len(part_files)), fun_type="list_sample")
+    with open(local_file, "wb") as out_f:
+        for part_file in part_files:
+            tmp_file = os.path.join(tmp_dir, os.path.basename(part_file))
+            with open(tmp_file, "rb") as f:
+                shutil.copyfileobj(f, out_f, 16 * 1024 * 1024)
+            os.remove(tmp_file)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    print("[INFO] Download success! {} part files merged, local file: {}".format(len(part_files), local_file))
+
+
 def upload_file(local_file, hdfs_file):
     if os.system("{} dfs -put -f '{}' '{}'".format(hdfs_cmd, local_file, hdfs_file)):
         raise Exception("Uplaod failed! local file: {}".format(local_file))
@@ -51,9 +151,10 @@ def read_csv(
     cache_dir="/UserData/data/.cache",
     redownload=False
 ):
-    base_name = os.path.basename(path)
-    cache_file = os.path.join(cache_dir, base_name)
     if path.startswith("hdfs://"):
+        # 用完整路径作为缓存key，避免不同目录下的同名part文件互相覆盖
+        cache_file = os.path.join(cache_dir, path.split("://", 1)[-1].lstrip("/"))
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
         download_file(path, cache_file, redownload)
         path = cache_file
     return pd.read_csv(
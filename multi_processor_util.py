@@ -1,6 +1,87 @@
+import os
+import re
+import sys
+import json
+import time
+import pickle
+import sqlite3
+import math
+import bisect
+import hashlib
+import queue
+import random
+import atexit
+import asyncio
+import threading
+import multiprocessing
 import numpy as np
+import pandas as pd
+from itertools import islice
 from functools import partial
-from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+class SharedExecutor:
+    """
+    进程内共享的常驻线程池，parall_fun系列调用都在这个池中执行，线程总数由max_workers统一控制
+        - 在池内线程中再次提交任务（如read_file -> parall_fun的嵌套调用）时直接在当前线程执行，
+          避免线程数成倍增长，也避免池被外层任务占满后内层任务永远排不上导致死锁
+        - 每次调用的并发数仍由调用方的k控制，k大于max_workers时以max_workers为准
+    """
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.pool = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def in_pool(self):
+        return getattr(self.local, "in_pool", False)
+
+    def run(self, fun, args, kwargs):
+        self.local.in_pool = True
+        return fun(*args, **kwargs)
+
+    def submit(self, fun, *args, **kwargs):
+        if self.in_pool():
+            future = Future()
+            try:
+                future.set_result(fun(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+        with self.lock:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="mechutils")
+            return self.pool.submit(self.run, fun, args, kwargs)
+
+    def set_max_workers(self, max_workers):
+        """修改全局线程数，已经提交的任务在旧线程池中执行完，新任务进入新的线程池
+        """
+        with self.lock:
+            self.max_workers = max_workers
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def shutdown(self, wait=True):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+
+shared_executor = SharedExecutor(int(os.environ.get("MECHUTILS_MAX_WORKERS", 256)))
+atexit.register(shared_executor.shutdown)
+
+
+def set_max_workers(max_workers):
+    shared_executor.set_max_workers(max_workers)
+
+
+max_processes = int(os.environ.get("MECHUTILS_MAX_PROCESSES", os.cpu_count() or 1))
+process_pool, process_pool_size = None, 0
+process_pool_lock = threading.Lock()
 
 
 def threaded_function_wrapper(fun, executor, i, d):
@@ -17,10 +98,9 @@ def multi_threading_execution(fun, inputs, k):
     k: 线程数
     """
     b = [None] * k
-    with ThreadPoolExecutor(max_workers=k) as executor:
-        futures = [threaded_function_wrapper(fun, executor, i, inputs[i]) for i in range(k)]
-        for future in futures:
-            b[future.index] = future.result()
+    futures = [threaded_function_wrapper(fun, shared_executor, i, inputs[i]) for i in range(k)]
+    for future in futures:
+        b[future.index] = future.result()
     return b
 
 
@@ -32,35 +112,618 @@ def multi_threading_execution_for_mutlifuncs(funs, inputs):
     """
     assert len(funs) == len(inputs), "[ERROR] funs nums must equal with inputs nums"
     b = [None] * len(funs)
-    with ThreadPoolExecutor(max_workers=len(funs)) as executor:
-        futures = [threaded_function_wrapper(funs[i], executor, i, inputs[i]) for i in range(len(funs))]
-        for future in futures:
-            b[future.index] = future.result()
+    futures = [threaded_function_wrapper(funs[i], shared_executor, i, inputs[i]) for i in range(len(funs))]
+    for future in futures:
+        b[future.index] = future.result()
     return b
 
 
-def fun_wrapper(input_dict, fun, fun_type="one_sample"):
+def get_process_pool(k):
+    """
+    进程内唯一的常驻进程池，避免每次调用都重新创建进程，也避免不同k各建一个池导致进程数成倍增长
+        - 池的大小只在需要更多进程时扩大，且不超过max_processes（环境变量MECHUTILS_MAX_PROCESSES，默认CPU核数）
+        - 池比k大时，每次调用的并发数由调用方在提交时控制，见process_submit
+    注意：进程池创建后才定义的__main__函数在子进程中找不到，可调用shutdown_process_pools后重建
+    """
+    global process_pool, process_pool_size
+    k = max(1, min(k, max_processes))
+    with process_pool_lock:
+        if process_pool is None or getattr(process_pool, "_broken", False) or process_pool_size < k:
+            # 先启动resource_tracker，fork出的子进程与主进程共用，共享内存只由主进程登记回收
+            resource_tracker.ensure_running()
+            old_pool, size = process_pool, max(k, process_pool_size)
+            process_pool, process_pool_size = ProcessPoolExecutor(max_workers=size), size
+            if old_pool is not None:
+                # 已提交的任务在旧池中执行完后旧池退出
+                old_pool.shutdown(wait=False)
+        return process_pool
+
+
+def process_submit(k, fun, *args):
+    """向常驻进程池提交任务，池在提交前被扩容替换时重新获取
+    """
+    while True:
+        pool = get_process_pool(k)
+        try:
+            return pool.submit(fun, *args)
+        except RuntimeError:
+            if pool is process_pool:
+                raise
+
+
+def set_max_processes(k):
+    """修改进程数上限，只影响之后新建的进程池
+    """
+    global max_processes
+    max_processes = k
+
+
+def shutdown_process_pools():
+    global process_pool, process_pool_size
+    with process_pool_lock:
+        pool, process_pool, process_pool_size = process_pool, None, 0
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(shutdown_process_pools)
+
+
+def to_shared_array(arr):
+    """将numpy数组拷贝到共享内存，返回(shm, ref)，ref可以低成本pickle传给子进程
+    """
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def attach_shared_array(ref):
+    name, shape, dtype = ref
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=name)
+        if multiprocessing.get_start_method() != "fork":
+            # 非fork的子进程有自己的resource_tracker，子进程只读不负责回收，由创建方unlink
+            resource_tracker.unregister(shm._name, "shared_memory")
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def is_shareable(values):
+    return isinstance(values.dtype, np.dtype) and values.dtype.kind in "biufcmM"
+
+
+def build_process_payloads(inputs, chunk_size):
+    """
+    将inputs切成多个chunk任务：
+        - np.ndarray: 数值数组整个放入共享内存，每个任务只传(ref, start, stop)；object、字符串等dtype按chunk切片后pickle，
+          共享内存中的对象指针在常驻进程池的子进程中无效
+        - pd.DataFrame: 数值列放入共享内存，其他列按chunk切片后pickle
+        - 其他: 按chunk切片后pickle
+    Returns:
+        payloads, shms
+    """
+    n, shms = len(inputs), []
+    bounds = [(i, min(i + chunk_size, n)) for i in range(0, n, chunk_size)]
+    if isinstance(inputs, np.ndarray) and is_shareable(inputs):
+        shm, ref = to_shared_array(inputs)
+        shms.append(shm)
+        payloads = [("array", ref, start, stop) for start, stop in bounds]
+    elif isinstance(inputs, pd.DataFrame):
+        refs = []
+        for col_id in range(inputs.shape[1]):
+            values = inputs.iloc[:, col_id].to_numpy()
+            if is_shareable(values):
+                shm, ref = to_shared_array(values)
+                shms.append(shm)
+                refs.append(ref)
+            else:
+                refs.append(None)
+        payloads = [(
+            "frame", refs, list(inputs.columns), inputs.index[start: stop],
+            {j: inputs.iloc[start: stop, j].to_numpy() for j, ref in enumerate(refs) if ref is None}, start, stop
+        ) for start, stop in bounds]
+    else:
+        payloads = [("list", inputs[start: stop]) for start, stop in bounds]
+    return payloads, shms
+
+
+def process_chunk(fun, fun_type, payload):
+    """子进程中执行一个chunk，共享内存中的数据只读视图，不做拷贝
+    """
+    shms = []
+    try:
+        if payload[0] == "array":
+            _, ref, start, stop = payload
+            shm, arr = attach_shared_array(ref)
+            shms.append(shm)
+            data = arr[start: stop]
+        elif payload[0] == "frame":
+            _, refs, columns, index, objects, start, stop = payload
+            cols = {}
+            for j, ref in enumerate(refs):
+                if ref is None:
+                    cols[j] = objects[j]
+                else:
+                    shm, arr = attach_shared_array(ref)
+                    shms.append(shm)
+                    cols[j] = arr[start: stop]
+            data = pd.DataFrame(cols, index=index)
+            data.columns = columns
+        else:
+            data = payload[1]
+
+        if fun_type == "one_sample":
+            res = [fun(x) for x in data]
+        elif fun_type == "list_sample":
+            res = fun(data)
+        else:
+            raise Exception(f"[ERROR] Unknown fun_type = '{fun_type}', expect ['one_sample', 'list_sample']")
+        del data
+        return list(res)
+    finally:
+        for shm in shms:
+            try:
+                shm.close()
+            except BufferError:
+                # fun的返回值仍然引用着共享内存，等待gc回收
+                pass
+
+
+def process_execution(fun, inputs, k, fun_type="one_sample", chunk_size=None):
+    """
+    多进程执行，使用常驻进程池，按chunk提交任务，结果按输入顺序返回
+        - fun: 需要可以pickle，即定义在模块顶层的函数（lambda不行）
+        - inputs: list、np.ndarray或pd.DataFrame，后两者通过共享内存传给子进程，DataFrame只支持list_sample
+        - chunk_size: 每个任务的数据量，默认切成k*4个任务
+    """
+    if isinstance(inputs, pd.DataFrame):
+        assert fun_type == "list_sample", "[ERROR] DataFrame inputs only support fun_type='list_sample'"
+    if len(inputs) == 0:
+        return []
+    chunk_size = chunk_size or max(1, int(np.ceil(len(inputs) / (k * 4))))
+    payloads, shms = build_process_payloads(inputs, chunk_size)
+    try:
+        # 进程池可能比k大，同时执行的任务数不超过k
+        futures, running = [], set()
+        for payload in payloads:
+            if len(running) >= k:
+                _, running = wait(running, return_when=FIRST_COMPLETED)
+            futures.append(process_submit(k, process_chunk, fun, fun_type, payload))
+            running.add(futures[-1])
+        res = []
+        for future in futures:
+            res.extend(future.result())
+        return res
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+class RateLimiter:
+    """
+    asyncio令牌桶限流，同时限制每秒请求数和每分钟token数
+        - qps: 每秒请求数上限，None为不限制
+        - tpm: 每分钟token数上限，None为不限制
+        - 被限流时调用throttle()，速率减半（不低于min_ratio），之后每次成功调用success()恢复recover，直到恢复到设定值
+    """
+    def __init__(self, qps=None, tpm=None, min_ratio=0.05, recover=0.02):
+        self.qps, self.tpm = qps, tpm
+        self.min_ratio, self.recover = min_ratio, recover
+        self.ratio = 1.0
+        self.req_capacity = max(1.0, qps or 0)
+        self.req_tokens, self.tpm_tokens = self.req_capacity, tpm or 0
+        self.last = time.monotonic()
+        self.lock = None
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed, self.last = now - self.last, now
+        if self.qps:
+            self.req_tokens = min(self.req_capacity, self.req_tokens + elapsed * self.qps * self.ratio)
+        if self.tpm:
+            self.tpm_tokens = min(self.tpm, self.tpm_tokens + elapsed * self.tpm / 60 * self.ratio)
+
+    async def acquire(self, tokens=1):
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        tokens = min(tokens, self.tpm) if self.tpm else tokens
+        async with self.lock:
+            while True:
+                self.refill()
+                wait_time = 0
+                if self.qps and self.req_tokens < 1:
+                    wait_time = max(wait_time, (1 - self.req_tokens) / (self.qps * self.ratio))
+                if self.tpm and self.tpm_tokens < tokens:
+                    wait_time = max(wait_time, (tokens - self.tpm_tokens) / (self.tpm / 60 * self.ratio))
+                if wait_time <= 0:
+                    self.req_tokens -= 1
+                    self.tpm_tokens -= tokens
+                    return
+                await asyncio.sleep(wait_time)
+
+    def throttle(self):
+        self.ratio = max(self.min_ratio, self.ratio * 0.5)
+
+    def success(self):
+        self.ratio = min(1.0, self.ratio + self.recover)
+
+
+throttled_msg_pattern = re.compile(r"\b429\b|rate[ _-]?limit|too many requests", re.I)
+
+
+def is_throttled_error(e):
+    """判断异常是否为服务端限流，兼容requests/httpx/openai等常见异常的status字段
+    """
+    status = getattr(e, "status_code", None) or getattr(e, "status", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status == 429 or throttled_msg_pattern.search(str(e)) is not None
+
+
+async def async_execution(fun, inputs, k, qps=None, tpm=None, token_fun=None, max_retries=5, backoff=1.0, is_throttled=is_throttled_error):
+    """
+    asyncio执行协程函数，结果按输入顺序返回
+        - fun: async def定义的协程函数，输入为inputs中的一个元素
+        - k: 最大并发数
+        - qps、tpm: 见RateLimiter
+        - token_fun: 估算每个输入消耗的token数，设置tpm时默认按len(str(x))估算
+        - max_retries、backoff: 被限流时的重试次数，以及指数退避的初始等待秒数
+        - is_throttled: 判断异常是否为限流的函数，其他异常直接抛出
+    """
+    limiter = RateLimiter(qps, tpm)
+    token_fun = token_fun or (lambda x: len(str(x)))
+    semaphore = asyncio.Semaphore(k)
+    res = [None] * len(inputs)
+
+    async def run(i):
+        async with semaphore:
+            tokens = token_fun(inputs[i]) if tpm else 1
+            for attempt in range(max_retries + 1):
+                await limiter.acquire(tokens)
+                try:
+                    res[i] = await fun(inputs[i])
+                    limiter.success()
+                    return
+                except Exception as e:
+                    if attempt >= max_retries or not is_throttled(e):
+                        raise
+                    limiter.throttle()
+                    await asyncio.sleep(backoff * 2 ** attempt * (0.5 + random.random()))
+
+    async def worker(ids):
+        for i in ids:
+            await run(i)
+
+    # k个worker共享同一个下标迭代器，避免一次性为所有输入创建协程
+    ids = iter(range(len(inputs)))
+    tasks = [asyncio.ensure_future(worker(ids)) for _ in range(min(k, len(inputs)))]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return res
+
+
+def run_coroutine(coro):
+    """在没有运行中的event loop时直接asyncio.run，否则（如jupyter中）放到新线程中运行
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def stable_hash(x):
+    """输入的稳定hash，跨进程、跨运行保持一致
+    """
+    try:
+        s = json.dumps(x, sort_keys=True, ensure_ascii=False, default=repr)
+    except TypeError:
+        s = repr(x)
+    return hashlib.md5(s.encode("utf-8")).hexdigest()
+
+
+class CheckpointStore:
+    """
+    parall_fun结果的断点存储，key为输入的stable_hash，在run_dir下追加写入
+        - fmt: jsonl（结果需要可以json序列化）或sqlite（结果pickle后存储）
+        - flush_interval: 结果先缓存在内存，每隔flush_interval秒落盘一次，进程崩溃最多丢失一个间隔的结果
+    """
+    def __init__(self, run_dir, fmt="jsonl", flush_interval=10):
+        assert fmt in ["jsonl", "sqlite"], f"[ERROR] Unknown checkpoint fmt = '{fmt}', expect ['jsonl', 'sqlite']"
+        os.makedirs(run_dir, exist_ok=True)
+        self.fmt, self.flush_interval = fmt, flush_interval
+        self.path = os.path.join(run_dir, "checkpoint." + fmt)
+        self.done, self.failed, self.buffer = {}, {}, []
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        if fmt == "sqlite":
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS checkpoint (key TEXT PRIMARY KEY, succ INTEGER, result BLOB, error TEXT)")
+        self.load()
+
+    def load(self):
+        if self.fmt == "sqlite":
+            records = ((key, succ, pickle.loads(result) if succ else None, error) for key, succ, result, error in self.conn.execute("SELECT * FROM checkpoint"))
+        elif os.path.exists(self.path):
+            records = []
+            for line in open(self.path, encoding="utf-8"):
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # 崩溃时可能写了半行，跳过
+                    continue
+                records.append((rec["key"], rec["succ"], rec.get("result"), rec.get("error", "")))
+        else:
+            records = []
+        for key, succ, result, error in records:
+            if succ:
+                self.done[key] = result
+                self.failed.pop(key, None)
+            else:
+                self.failed[key] = error
+
+    def add(self, key, succ, result=None, error=""):
+        if self.fmt == "sqlite":
+            record = (key, int(succ), pickle.dumps(result) if succ else None, error)
+        else:
+            record = json.dumps({"key": key, "succ": succ, "result": result, "error": error}, ensure_ascii=False) + "\n"
+        with self.lock:
+            self.buffer.append(record)
+            if succ:
+                self.done[key] = result
+                self.failed.pop(key, None)
+            else:
+                self.failed[key] = error
+            if time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            if self.fmt == "sqlite":
+                self.conn.executemany("INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?)", self.buffer)
+                self.conn.commit()
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write("".join(self.buffer))
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+
+def checkpoint_execution(fun, inputs, k, run_dir, fmt="jsonl", flush_interval=10, **kwargs):
+    """
+    带断点续跑的parall_fun：已成功的输入直接读取结果，只执行缺失或失败的输入
+    单个输入报错不会中断其他输入，全部执行完后如果有失败则抛出异常，重新运行即可只重试失败的部分
+    """
+    store = CheckpointStore(run_dir, fmt=fmt, flush_interval=flush_interval)
+    keys = [stable_hash(x) for x in inputs]
+    todo, seen = [], set()
+    for i, key in enumerate(keys):
+        if key not in store.done and key not in seen:
+            seen.add(key)
+            todo.append(i)
+    print(f"[INFO] Checkpoint '{store.path}': {sum(key in store.done for key in keys)} inputs done, {len(todo)} inputs to run")
+
+    def run_one(i):
+        try:
+            res = fun(inputs[i])
+        except Exception as e:
+            store.add(keys[i], False, error=repr(e))
+            return False
+        store.add(keys[i], True, res)
+        return True
+
+    try:
+        if todo:
+            parall_fun(run_one, todo, min(k, len(todo)), **kwargs)
+    finally:
+        store.flush()
+    failed = [key for key in keys if key not in store.done]
+    if failed:
+        raise Exception(f"[ERROR] {len(failed)} inputs failed, finished results saved in '{store.path}', rerun to retry them. first error: {store.failed.get(failed[0])}")
+    return [store.done[key] for key in keys]
+
+
+class HedgePolicy:
+    """
+    推测执行（hedging）策略：某个输入的执行时间超过已完成输入耗时的percentile分位数时，在空闲线程上再发起一次，先返回的结果生效
+        - percentile: 触发推测执行的耗时分位数
+        - min_samples: 至少完成多少个输入后才开始推测执行
+        - max_extra: 推测执行次数上限，占输入数的比例，控制额外负载
+        - timeout: 单个输入的超时秒数，从第一次执行开始计算，所有尝试都未返回则抛出TimeoutError，None为不限制
+        - poll: 检查慢输入的间隔秒数
+        - stats: fired为推测执行次数，won为推测执行先返回的次数，timeouts为超时次数
+    """
+    def __init__(self, percentile=95, min_samples=20, max_extra=0.05, timeout=None, poll=0.05):
+        self.percentile, self.min_samples, self.max_extra = percentile, min_samples, max_extra
+        self.timeout, self.poll = timeout, poll
+        self.stats = {"fired": 0, "won": 0, "timeouts": 0}
+
+
+def hedged_execution(fun, inputs, k, policy, metrics=None):
+    """
+    带推测执行的多线程执行，k个线程同时被正常任务和推测任务使用，只有存在空闲线程时才会发起推测执行，结果按输入顺序返回
+    注意：落后的那次执行无法被中断，返回时不等待，会在共享线程池中执行完后丢弃结果
+    """
+    n = len(inputs)
+    res, finished = [None] * n, [False] * n
+    budget = int(policy.max_extra * n)
+    latencies, starts, meta, active, running = [], {}, {}, {}, set()
+
+    def timed_call(i, token):
+        starts[token] = time.monotonic()
+        return fun(inputs[i]), time.monotonic() - starts[token]
+
+    def submit(i, is_hedge):
+        token = object()
+        future = shared_executor.submit(timed_call, i, token)
+        meta[future] = (i, token, is_hedge)
+        active.setdefault(i, []).append(token)
+        running.add(future)
+
+    next_i, n_finished = 0, 0
+    try:
+        # 所有输入都有结果即返回，落后的尝试不再等待
+        while n_finished < n:
+            while next_i < n and len(running) < k:
+                submit(next_i, False)
+                next_i += 1
+            done, _ = wait(running, timeout=policy.poll, return_when=FIRST_COMPLETED)
+            for future in done:
+                running.discard(future)
+                i, token, is_hedge = meta.pop(future)
+                if finished[i]:
+                    continue
+                try:
+                    value, elapsed = future.result()
+                except Exception:
+                    # 同一输入还有其他尝试在执行，以其结果为准
+                    if any(f for f, m in meta.items() if m[0] == i):
+                        continue
+                    raise
+                finished[i], res[i] = True, value
+                n_finished += 1
+                active.pop(i, None)
+                bisect.insort(latencies, elapsed)
+                policy.stats["won"] += int(is_hedge)
+                if metrics is not None:
+                    metrics.record(elapsed)
+
+            now = time.monotonic()
+            if policy.timeout:
+                for i, tokens in active.items():
+                    if tokens[0] in starts and now - starts[tokens[0]] > policy.timeout:
+                        policy.stats["timeouts"] += 1
+                        raise TimeoutError(f"[ERROR] Input {i} timeout after {policy.timeout}s, input={inputs[i]}")
+            if len(latencies) >= policy.min_samples:
+                threshold = latencies[min(len(latencies) - 1, int(len(latencies) * policy.percentile / 100))]
+                for i, tokens in list(active.items()):
+                    if len(running) >= k or policy.stats["fired"] >= budget:
+                        break
+                    if len(tokens) == 1 and tokens[0] in starts and now - starts[tokens[0]] > threshold:
+                        submit(i, True)
+                        policy.stats["fired"] += 1
+    finally:
+        for future in running:
+            future.cancel()
+    print(f"[INFO] Hedge stats: {policy.stats}")
+    return res
+
+
+def format_progress(m):
+    fmt_sec = lambda x: "-" if x is None else f"{x:.3f}s"
+    total = m["total"] if m["total"] is not None else "?"
+    return (
+        f"[PROGRESS] {m['name']} {m['done']}/{total} items, {m['items_per_sec']:.1f} items/s, "
+        f"p50={fmt_sec(m['p50'])} p95={fmt_sec(m['p95'])} p99={fmt_sec(m['p99'])}, "
+        f"elapsed={m['elapsed']:.1f}s eta={fmt_sec(m['eta'])}, workers={len(m['workers'])}"
+    )
+
+
+class ProgressMetrics:
+    """
+    多线程执行的进度与吞吐统计，代替逐条打印输入：
+        - 统计每个线程的完成数、总完成数、items/sec、单条耗时的p50/p95/p99以及ETA
+        - 耗时用对数分桶直方图统计，内存固定，分位数误差在一个桶宽(约10%)以内
+        - record时每隔interval秒发布一次快照给callback，callback输入为dict，默认打印format_progress的结果
+    """
+    base, ratio, bucket_num = 1e-6, 1.1, 300
+
+    def __init__(self, total=None, interval=10, callback=None, name="parall_fun"):
+        self.total, self.interval, self.name = total, interval, name
+        self.callback = callback or (lambda m: print(format_progress(m)))
+        self.buckets = [0] * self.bucket_num
+        self.workers = {}
+        self.done = 0
+        self.start = self.last_publish = time.monotonic()
+        self.lock = threading.Lock()
+
+    def record(self, latency, n=1, worker=None):
+        """记录n条完成的数据，latency为单条耗时
+        """
+        worker = worker or threading.current_thread().name
+        idx = 0 if latency <= self.base else min(self.bucket_num - 1, int(math.log(latency / self.base, self.ratio)) + 1)
+        with self.lock:
+            self.done += n
+            self.buckets[idx] += n
+            self.workers[worker] = self.workers.get(worker, 0) + n
+            now = time.monotonic()
+            if now - self.last_publish < self.interval:
+                return
+            self.last_publish = now
+            snapshot = self._snapshot(now)
+        self.callback(snapshot)
+
+    def percentile(self, p):
+        target, acc = self.done * p / 100, 0
+        for idx, count in enumerate(self.buckets):
+            acc += count
+            if count and acc >= target:
+                # 返回桶的几何中点
+                return self.base * self.ratio ** (idx - 0.5) if idx else self.base
+        return None
+
+    def _snapshot(self, now):
+        elapsed = now - self.start
+        speed = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / speed if self.total is not None and speed > 0 else None
+        return {
+            "name": self.name, "done": self.done, "total": self.total, "elapsed": elapsed, "items_per_sec": speed, "eta": eta,
+            "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99), "workers": dict(self.workers)
+        }
+
+    def snapshot(self):
+        with self.lock:
+            return self._snapshot(time.monotonic())
+
+    def publish(self):
+        self.callback(self.snapshot())
+
+
+def build_metrics(progress, total=None, interval=10, name="parall_fun"):
+    """progress: False/None不统计，True默认打印，callable则作为callback
+    嵌套在池内线程中的调用不默认打印，由外层调用统计
+    """
+    if not progress or (progress is True and shared_executor.in_pool()):
+        return None
+    return ProgressMetrics(total=total, interval=interval, callback=progress if callable(progress) else None, name=name)
+
+
+def fun_wrapper(input_dict, fun, fun_type="one_sample", metrics=None):
     """
     fun_type: 为了支持多种类型的fun
         - one_sample: 每个fun输入为list中的一个元素，fun本身输入为一个元素
         - list_sample: 每个fun输入为list的子list，fun本身输入为一个list
+    metrics: ProgressMetrics，统计进度与耗时
     """
     inputs = input_dict["inputs"]
-    thread_id = input_dict["thread_id"]
     if fun_type == "one_sample":
         res = []
-        for input_id, input_value in enumerate(inputs):
-            print(f"[THREAD INFO] Thread {thread_id} {input_id}-th input={input_value}\n", end="")
-            tmp_res = fun(input_value)
-            res.append(tmp_res)
+        for input_value in inputs:
+            start = time.monotonic()
+            res.append(fun(input_value))
+            if metrics is not None:
+                metrics.record(time.monotonic() - start)
     elif fun_type == "list_sample":
+        start = time.monotonic()
         res = fun(inputs)
+        if metrics is not None and len(inputs):
+            metrics.record((time.monotonic() - start) / len(inputs), n=len(inputs))
     else:
         raise Exception(f"[ERROR] Unknown fun_type = '{fun_type}', expect ['one_sample', 'list_sample']")
     return res
 
 
-def parall_fun(fun, inputs, k, data_split="avg", fun_type="one_sample"):
+def parall_fun(fun, inputs, k, data_split="avg", fun_type="one_sample", schedule="static", chunk_size=None, backend="thread", qps=None, tpm=None, token_fun=None, checkpoint_dir=None, checkpoint_fmt="jsonl", flush_interval=10, hedge=None, progress=True, progress_interval=10):
     """
     按照顺序多线程执行程序
         - fun: 要多线程执行的程序
@@ -73,7 +736,56 @@ def parall_fun(fun, inputs, k, data_split="avg", fun_type="one_sample"):
         - fun_type: 为了支持多种类型的fun
             + one_sample: 每个fun输入为list中的一个元素，fun本身输入为一个元素
             + list_sample: 每个fun输入为list的子list，fun本身输入为一个list
+        - schedule: 
+            + static: 默认，按data_split预先切成k份，每个线程处理一份
+            + dynamic: 按chunk_size切成小块放入共享队列，空闲线程动态领取，避免个别慢数据拖慢整体，此时data_split无效
+        - chunk_size: dynamic或process模式下每个任务的数据量，list_sample时即为每次传给fun的list长度，dynamic默认为1
+        - backend:
+            + thread: 默认，多线程执行
+            + process: 常驻进程池执行，适合CPU密集的fun，按chunk提交任务，np.ndarray和DataFrame通过共享内存传递，此时data_split和schedule无效
+            + async: fun为协程函数，asyncio执行，k为最大并发数，适合大量的模型服务请求，只支持one_sample
+        - qps、tpm、token_fun: async模式下的每秒请求数、每分钟token数限流，以及token估算函数，被限流时自动退避降速
+        - checkpoint_dir: 断点目录，设置后每个输入的结果按输入hash持久化，重新运行时跳过已成功的输入，只支持thread + one_sample
+        - checkpoint_fmt、flush_interval: 断点存储格式jsonl或sqlite，以及落盘间隔秒数，见CheckpointStore
+        - hedge: HedgePolicy，设置后对耗时长尾的输入在空闲线程上推测执行，先返回的结果生效，只支持thread + one_sample，统计见hedge.stats
+        - progress: 进度与吞吐统计（thread模式），True每隔progress_interval秒以及结束时打印一行[PROGRESS]，
+            callable则作为callback接收统计dict，False关闭，见ProgressMetrics
     """
+    if hedge is not None:
+        assert backend == "thread" and fun_type == "one_sample", "[ERROR] hedge only support backend='thread' and fun_type='one_sample'"
+        if checkpoint_dir:
+            return checkpoint_execution(
+                fun, inputs, k, checkpoint_dir, fmt=checkpoint_fmt, flush_interval=flush_interval, 
+                hedge=hedge, progress=progress, progress_interval=progress_interval
+            )
+        metrics = build_metrics(progress, len(inputs), progress_interval)
+        res = hedged_execution(fun, inputs, k, hedge, metrics=metrics)
+        metrics and metrics.publish()
+        return res
+    if checkpoint_dir:
+        assert backend == "thread" and fun_type == "one_sample", "[ERROR] checkpoint only support backend='thread' and fun_type='one_sample'"
+        return checkpoint_execution(
+            fun, inputs, k, checkpoint_dir, fmt=checkpoint_fmt, flush_interval=flush_interval, 
+            data_split=data_split, schedule=schedule, chunk_size=chunk_size, progress=progress, progress_interval=progress_interval
+        )
+    if backend == "process":
+        return process_execution(fun, inputs, k, fun_type=fun_type, chunk_size=chunk_size)
+    elif backend == "async":
+        assert fun_type == "one_sample", "[ERROR] backend='async' only support fun_type='one_sample'"
+        return run_coroutine(async_execution(fun, list(inputs), k, qps=qps, tpm=tpm, token_fun=token_fun))
+    elif backend != "thread":
+        raise Exception(f"[ERROR] Unknown backend = '{backend}', expect ['thread', 'process', 'async']")
+
+    if schedule == "dynamic":
+        # 结果全部需要返回，不限制in-flight，避免慢数据阻塞后续任务的提交
+        chunk_size = chunk_size or 1
+        return list(iparall_fun(
+            fun, inputs, k, max_inflight=len(inputs) // chunk_size + 1, chunk_size=chunk_size, fun_type=fun_type, 
+            progress=progress, progress_interval=progress_interval
+        ))
+    elif schedule != "static":
+        raise Exception(f"[ERROR] Unknown schedule = '{schedule}', expect ['static', 'dynamic']")
+
     if data_split == "avg":
         size = len(inputs) // k
         package_inputs = []
@@ -99,15 +811,247 @@ def parall_fun(fun, inputs, k, data_split="avg", fun_type="one_sample"):
                 start = sum(split_nums[:i])
                 package_inputs.append(inputs[start:])
 
-    wrapped_fun = partial(fun_wrapper, fun=fun, fun_type=fun_type)
+    metrics = build_metrics(progress, len(inputs), progress_interval)
+    wrapped_fun = partial(fun_wrapper, fun=fun, fun_type=fun_type, metrics=metrics)
     m_res = multi_threading_execution(wrapped_fun, package_inputs, k)
     res = []
     for line in m_res:
         res.extend(line)
+    metrics and metrics.publish()
     return res
 
 
+def iter_chunks(inputs, chunk_size):
+    it = iter(inputs)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iparall_fun(fun, inputs, k, max_inflight=None, ordered=True, chunk_size=1, fun_type="one_sample", backend="thread", progress=False, progress_interval=10):
+    """
+    惰性版本的parall_fun，返回生成器，结果一旦就绪就产出，不需要全部结果都放在内存中
+        - inputs: 任意可迭代对象，可以是长度未知的生成器，按需读取
+        - k: 并发数，同时执行的chunk数不超过k
+        - max_inflight: 已提交但还未产出的chunk数上限，默认k*2，用来限制内存
+        - ordered: True按输入顺序产出，False按完成顺序产出
+        - chunk_size: 每个任务的数据量，list_sample时即为每次传给fun的list长度
+        - fun_type: 同parall_fun
+        - backend: thread（共享线程池） or process（常驻进程池，fun需要可以pickle）
+        - progress、progress_interval: 同parall_fun，仅thread模式，默认关闭
+    """
+    max_inflight = max(max_inflight or k * 2, k)
+    metrics = build_metrics(progress if backend == "thread" else None, len(inputs) if hasattr(inputs, "__len__") else None, progress_interval)
+    if backend == "thread":
+        wrapped_fun = partial(fun_wrapper, fun=fun, fun_type=fun_type, metrics=metrics)
+        submit = lambda i, chunk: threaded_function_wrapper(wrapped_fun, shared_executor, i, chunk)
+    elif backend == "process":
+        submit = lambda i, chunk: process_submit(k, process_chunk, fun, fun_type, ("list", chunk))
+    else:
+        raise Exception(f"[ERROR] Unknown backend = '{backend}', expect ['thread', 'process']")
+
+    chunks = enumerate(iter_chunks(inputs, chunk_size))
+    running, done_buffer = {}, {}
+    next_yield, exhausted = 0, False
+    try:
+        while True:
+            while not exhausted and len(running) < k and len(running) + len(done_buffer) < max_inflight:
+                item = next(chunks, None)
+                if item is None:
+                    exhausted = True
+                else:
+                    running[submit(*item)] = item[0]
+            if ordered and next_yield in done_buffer:
+                yield from done_buffer.pop(next_yield).result()
+                next_yield += 1
+                continue
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                if ordered:
+                    done_buffer[i] = future
+                else:
+                    yield from future.result()
+    finally:
+        for future in running:
+            future.cancel()
+        metrics and metrics.publish()
+
+
 def parall_funs(funs, inputs):
     wrapped_funs = [partial(fun_wrapper, fun=fun, fun_type="list_sample") for fun in funs]
     m_res = multi_threading_execution_for_mutlifuncs(wrapped_funs, inputs)
-    return m_res
\ No newline at end of file
+    return m_res
+
+
+class Stage:
+    """
+    Pipeline中的一个阶段
+        - fun: 输入为上一阶段的一个输出，返回一个输出
+        - workers: 该阶段的并发数
+        - backend: thread or process，process时fun需要可以pickle，在常驻进程池中执行
+        - queue_size: 该阶段输入队列的长度，默认使用Pipeline的queue_size，队列满时上游阻塞（背压）
+        - stats: items为处理条数，busy为fun累计耗时，wait_in为等待上游的累计时间，wait_out为被下游阻塞的累计时间
+    """
+    def __init__(self, fun, workers=1, backend="thread", name=None, queue_size=None):
+        assert backend in ["thread", "process"], f"[ERROR] Unknown backend = '{backend}', expect ['thread', 'process']"
+        self.fun, self.workers, self.backend, self.queue_size = fun, workers, backend, queue_size
+        self.name, self.named = name or getattr(fun, "__name__", "stage"), name is not None
+        self.stats = {"items": 0, "busy": 0.0, "wait_in": 0.0, "wait_out": 0.0}
+        self.lock = threading.Lock()
+
+    def call(self, x):
+        if self.backend == "process":
+            return process_submit(self.workers, process_chunk, self.fun, "one_sample", ("list", [x])).result()[0]
+        return self.fun(x)
+
+
+class Pipeline:
+    """
+    多阶段流水线，如 下载 -> 解析 -> 转换 -> 模型请求 -> 保存，各阶段之间用有界队列连接，各阶段同时运行：
+        - 每个阶段有自己的并发数和backend
+        - 队列有界，并且同时在流水线中的数据数不超过max_inflight，快的阶段不会无限堆积数据
+        - 任一阶段报错则整个流水线停止并抛出该错误
+        - report()输出每个阶段的耗时统计，用来定位瓶颈，未指定name的阶段显示为"序号:函数名"，避免多个lambda阶段重名
+        - 各阶段的worker是独立的线程，没有使用parall_funs/共享线程池：worker在整个流水线运行期间一直阻塞在队列上，
+          放在共享线程池中会长期占满线程，导致其他parall_fun调用排不上
+    """
+    def __init__(self, stages, queue_size=64, max_inflight=None):
+        self.stages, self.queue_size = stages, queue_size
+        self.max_inflight = max_inflight or queue_size * (len(stages) + 1) + sum(s.workers for s in stages)
+
+    def run(self, inputs, ordered=True):
+        """返回生成器，ordered为True时按输入顺序产出，否则按完成顺序产出
+        """
+        stages = self.stages
+        queues = [queue.Queue(maxsize=s.queue_size or self.queue_size) for s in stages] + [queue.Queue()]
+        stop, errors = threading.Event(), []
+        inflight = threading.Semaphore(self.max_inflight)
+        alive = [s.workers for s in stages]
+        stop_mark = object()
+
+        def put(q, item, stats=None):
+            start = time.monotonic()
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if stats is not None:
+                stats["wait_out"] += time.monotonic() - start
+
+        def get(q, stats):
+            start = time.monotonic()
+            while not stop.is_set():
+                try:
+                    item = q.get(timeout=0.1)
+                    stats["wait_in"] += time.monotonic() - start
+                    return item
+                except queue.Empty:
+                    continue
+            return stop_mark
+
+        def source():
+            try:
+                for item in enumerate(inputs):
+                    while not inflight.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    put(queues[0], item)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                for _ in range(stages[0].workers):
+                    put(queues[0], stop_mark)
+
+        def worker(stage_id):
+            stage, stats = stages[stage_id], {"items": 0, "busy": 0.0, "wait_in": 0.0, "wait_out": 0.0}
+            try:
+                while True:
+                    item = get(queues[stage_id], stats)
+                    if item is stop_mark:
+                        break
+                    start = time.monotonic()
+                    value = stage.call(item[1])
+                    stats["busy"] += time.monotonic() - start
+                    stats["items"] += 1
+                    put(queues[stage_id + 1], (item[0], value), stats)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                with stage.lock:
+                    for key, value in stats.items():
+                        stage.stats[key] += value
+                    alive[stage_id] -= 1
+                    last = alive[stage_id] == 0
+                if last:
+                    next_workers = stages[stage_id + 1].workers if stage_id + 1 < len(stages) else 1
+                    for _ in range(next_workers):
+                        put(queues[stage_id + 1], stop_mark)
+
+        threads = [threading.Thread(target=source, daemon=True)]
+        for stage_id, stage in enumerate(stages):
+            threads.extend([threading.Thread(target=worker, args=(stage_id,), daemon=True) for _ in range(stage.workers)])
+        for t in threads:
+            t.start()
+
+        buffer, next_id, consumer_stats = {}, 0, {"wait_in": 0.0}
+        try:
+            while True:
+                item = get(queues[-1], consumer_stats)
+                if item is stop_mark:
+                    break
+                if not ordered:
+                    inflight.release()
+                    yield item[1]
+                    continue
+                buffer[item[0]] = item[1]
+                while next_id in buffer:
+                    inflight.release()
+                    yield buffer.pop(next_id)
+                    next_id += 1
+            if errors:
+                raise errors[0]
+        finally:
+            stop.set()
+
+    def report(self, print_fun=print):
+        """输出每个阶段的统计，util为fun耗时占该阶段总线程时间的比例，最忙的阶段即为瓶颈
+        """
+        rows = []
+        for i, stage in enumerate(self.stages):
+            stats = dict(stage.stats)
+            total = stats["busy"] + stats["wait_in"] + stats["wait_out"]
+            stats.update({
+                "name": stage.name if stage.named else f"{i}:{stage.name}", "workers": stage.workers, "backend": stage.backend,
+                "avg_latency": stats["busy"] / stats["items"] if stats["items"] else 0.0,
+                "util": stats["busy"] / total if total > 0 else 0.0
+            })
+            rows.append(stats)
+        bottleneck = max(range(len(rows)), key=lambda i: rows[i]["busy"] / rows[i]["workers"]) if rows else None
+        for i, r in enumerate(rows):
+            print_fun(
+                f"[PIPELINE] stage={r['name']} workers={r['workers']} backend={r['backend']} items={r['items']} "
+                f"busy={r['busy']:.2f}s avg={r['avg_latency']:.4f}s util={r['util']:.1%} "
+                f"wait_in={r['wait_in']:.2f}s wait_out={r['wait_out']:.2f}s" + (" <- bottleneck" if i == bottleneck else "")
+            )
+        return rows
+
+
+def run_pipeline(stages, inputs, queue_size=64, ordered=True):
+    """
+    流水线执行并返回list，结束后打印各阶段统计
+        - stages: Stage列表，或者(fun, workers)元组列表
+    """
+    stages = [s if isinstance(s, Stage) else Stage(*s) for s in stages]
+    pipeline = Pipeline(stages, queue_size=queue_size)
+    res = list(pipeline.run(inputs, ordered=ordered))
+    pipeline.report()
+    return res
@@ -4,8 +4,11 @@ pangu比较特殊，路径后面必须有/，否则都代表文件
 
 import os
 import tqdm
+import shutil
 import datetime
-from .multi_processor_util import parall_fun
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from .multi_processor_util import parall_fun, shared_executor
 from .print_util import print_paths
 
 pu_cmd = "pu"
@@ -157,8 +160,46 @@ def download_file(pangu_file, local_file):
         raise Exception("[ERROR] Local dir not found: %s" % loacl_dir)
 
 
-def download_dir(pangu_dir, local_file, thread=256, merge=True):
+def append_part(part_file, out_f, buffer_size=16 * 1024 * 1024):
+    """将part文件追加写入out_f，并立即删除part文件
+    """
+    with open(part_file, "rb") as f:
+        shutil.copyfileobj(f, out_f, buffer_size)
+    os.remove(part_file)
+
+
+def stream_download_merge(input_args, local_file, thread=256, reorder_buffer=64):
+    """边下载边按顺序合并：
+        - input_args: [[pangu_file, tmp_part_file], ...]，按tmp_part_file排序后的顺序合并，与merge_file一致
+        - 同时下载的part最多thread个，与merge=True时的并发一致
+        - 已下载但前序part还未完成的文件最多reorder_buffer个，超过则暂停提交新的下载任务
+        - part追加到local_file后立即删除，磁盘上不会同时存在两份完整数据
+    """
+    input_args = sorted(input_args, key=lambda x: x[1])
+    pending = deque()
+    next_id = 0
+    with open(local_file, "wb") as out_f, tqdm.tqdm(total=len(input_args)) as bar:
+        while next_id < len(input_args) or pending:
+            while pending and pending[0][0].done():
+                future, part_file = pending.popleft()
+                future.result()
+                append_part(part_file, out_f)
+                bar.update(1)
+            done_num = sum(future.done() for future, _ in pending)
+            if next_id < len(input_args) and len(pending) - done_num < thread and done_num < reorder_buffer:
+                pangu_file, part_file = input_args[next_id]
+                pending.append((shared_executor.submit(download_file, pangu_file, part_file), part_file))
+                next_id += 1
+            elif pending:
+                wait([future for future, _ in pending if not future.done()], return_when=FIRST_COMPLETED)
+
+
+def download_dir(pangu_dir, local_file, thread=256, merge=True, reorder_buffer=64):
     """目录文件需要多线程加速下载，支持通配符，pangu_dir里面通配的是dir，会把所有dir下的文件都保存在一个本地local文件中
+        - merge:
+            + True: 全部下载到隐藏临时目录后再统一合并
+            + "stream": 边下载边按顺序合并，part合并后立即删除，reorder_buffer控制乱序缓存的part数
+            + False: 不合并，保留为目录
     """
     loacl_dir = os.path.dirname(local_file)
     loacl_base = os.path.basename(local_file)
@@ -176,8 +217,13 @@ def download_dir(pangu_dir, local_file, thread=256, merge=True):
             path_list.extend([i for i in glob_pangu(tmp_pdir) if not i.endswith("/")])
         assert path_list, "Match nothing file for %s" % pangu_dir
         input_args = [[i, os.path.join(tmp_dir, ".".join(i.split("/")[-2:]))] for i in path_list]
+        if merge == "stream":
+            stream_download_merge(input_args, local_file, thread=thread, reorder_buffer=reorder_buffer)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            print("[INFO] <%s> Download and stream merge success! local path: %s" % (now(), local_file))
+            return
         download_file_fun = lambda x: [download_file(i[0], i[1]) for i in tqdm.tqdm(x)]
-        parall_fun(download_file_fun, input_args, min(thread, len(input_args)), fun_type="data")
+        parall_fun(download_file_fun, input_args, min(thread, len(input_args)), fun_type="list_sample")
         if merge and merge_file(tmp_dir, local_file):
             print("[INFO] <%s> Download and merge success! local path: %s" % (now(), local_file))
         else:
@@ -1,10 +1,20 @@
+import os
+import re
 import json
-import unicodedata
+import atexit
+import pickle
+import sqlite3
+import hashlib
+import threading
+from functools import partial
+from collections import OrderedDict
 from json import JSONDecodeError
 
 import pandas as pd
-import numpy as np
 from utils import oss_util, hdfs_util
+from utils.multi_processor_util import parall_fun
+
+bracket_patterns = {}
 
 
 def get_json(string, bracket = '{}'):
@@ -18,36 +28,198 @@ def get_json(string, bracket = '{}'):
     stack = []
     
     contain_json = []
-    for i in range(len(string)):
+    if bracket[0] not in string:
+        return contain_json, stack
+    if bracket not in bracket_patterns:
+        bracket_patterns[bracket] = re.compile("[" + re.escape(bracket) + "]")
+    # 用正则直接跳到括号位置，避免python逐字符扫描
+    for m in bracket_patterns[bracket].finditer(string):
+        i = m.start()
         if string[i] == bracket[0]:
             stack.append(i)
-        elif string[i] == bracket[1] and stack:
+        elif stack:
             last_barce_id = stack.pop()
             if not stack:
                 contain_json.append(string[last_barce_id: i + 1])
-            else:
-                pass
-        else:
-            continue
             
     return contain_json, stack
 
 
+fullwidth_punct = {"，": ",", "：": ":", "｛": "{", "｝": "}", "［": "[", "］": "]"}
+dropped_punct = set("。【】")
+quote_pairs = {'"': '"', "'": "'", "“": "”", "‘": "’"}
+python_literals = {"True": "true", "False": "false", "None": "null"}
+valid_escapes = set('"\\/bfnrtu')
+bareword_pattern = re.compile(r"""[^\s,:{}\[\]"'“‘/，：｛｝［］。【】]+""")
+string_run_patterns = {closer: re.compile("[^" + re.escape('"\\\n\r\t' + closer) + "]+") for closer in set(quote_pairs.values())}
+
+
+def repair_json_str(s):
+    """
+    单次扫描的容错json修复，只有一个输出buffer，线性复杂度，字符串字面量中的内容原样保留：
+        - 字符串外的中文标点（，：｛｝［］）转为英文，。【】直接去掉
+        - 去掉//和/* */注释、多余的逗号和结尾逗号，补全缺失的逗号和冒号
+        - 单引号和中文引号的字符串转为双引号，字符串中的换行等控制字符和非法转义会被转义
+        - 未加引号的key加上引号，True/False/None转为true/false/null，补全未闭合的字符串和括号
+    Returns:
+        (修复后的字符串, 应用过的修复列表)
+    """
+    out, repairs = [], set()
+    # stack中每个元素为[括号类型, 状态]，状态：key（等待key）、colon（等待冒号）、value（等待值）、comma（等待逗号或结束）
+    stack, top = [], ["", "value"]
+    last_sig = -1
+    i, n = 0, len(s)
+
+    def emit(x, significant=True):
+        nonlocal last_sig
+        out.append(x)
+        if significant:
+            last_sig = len(out) - 1
+
+    def begin_value():
+        # 一个新的值（或key）开始前，补全缺失的逗号或冒号
+        cur = stack[-1] if stack else top
+        if stack and cur[1] == "comma":
+            emit(",")
+            repairs.add("missing_comma")
+            cur[1] = "key" if cur[0] == "{" else "value"
+        elif cur[1] == "colon":
+            emit(":")
+            repairs.add("missing_colon")
+            cur[1] = "value"
+        return cur
+
+    def end_value(cur):
+        cur[1] = "colon" if cur[0] == "{" and cur[1] == "key" else "comma"
+
+    def close_container():
+        if out and last_sig >= 0 and out[last_sig] == ",":
+            out[last_sig] = ""
+            repairs.add("trailing_comma")
+        emit("}" if stack.pop()[0] == "{" else "]")
+        end_value(stack[-1] if stack else top)
+
+    while i < n:
+        c = s[i]
+        if c in " \t\r\n":
+            emit(c, significant=False)
+            i += 1
+            continue
+        if c == "/" and s[i + 1: i + 2] in ("/", "*"):
+            if s[i + 1] == "/":
+                j = s.find("\n", i)
+                i = n if j == -1 else j
+            else:
+                j = s.find("*/", i + 2)
+                i = n if j == -1 else j + 2
+            repairs.add("comment")
+            continue
+        if c in fullwidth_punct:
+            c = fullwidth_punct[c]
+            repairs.add("fullwidth_punct")
+        if c in dropped_punct:
+            repairs.add("fullwidth_punct")
+            i += 1
+        elif c in quote_pairs:
+            cur = begin_value()
+            closer = quote_pairs[c]
+            if c != '"':
+                repairs.add("quote")
+            emit('"')
+            i += 1
+            run_pattern = string_run_patterns[closer]
+            while True:
+                m = run_pattern.match(s, i)
+                if m:
+                    emit(m.group(), significant=False)
+                    i = m.end()
+                if i >= n:
+                    repairs.add("unclosed_string")
+                    break
+                ch = s[i]
+                if ch == closer:
+                    i += 1
+                    break
+                elif ch == "\\":
+                    nxt = s[i + 1: i + 2]
+                    if nxt == closer and closer != '"':
+                        emit(nxt, significant=False)
+                        i += 2
+                    elif nxt and nxt in valid_escapes:
+                        emit(ch + nxt, significant=False)
+                        i += 2
+                    else:
+                        emit("\\\\", significant=False)
+                        repairs.add("invalid_escape")
+                        i += 1
+                elif ch == '"':
+                    emit('\\"', significant=False)
+                    i += 1
+                else:
+                    emit({"\n": "\\n", "\r": "\\r", "\t": "\\t"}[ch], significant=False)
+                    repairs.add("control_char")
+                    i += 1
+            emit('"')
+            end_value(cur)
+        elif c in "{[":
+            begin_value()
+            emit(c)
+            stack.append([c, "key" if c == "{" else "value"])
+            i += 1
+        elif c in "}]":
+            if not stack:
+                repairs.add("extra_bracket")
+            else:
+                if (stack[-1][0] == "{") != (c == "}"):
+                    repairs.add("bracket_mismatch")
+                close_container()
+            i += 1
+        elif c == ",":
+            cur = stack[-1] if stack else top
+            if cur[1] == "comma":
+                emit(",")
+                cur[1] = "key" if cur[0] == "{" else "value"
+            else:
+                repairs.add("extra_comma")
+            i += 1
+        elif c == ":":
+            cur = stack[-1] if stack else top
+            emit(":")
+            cur[1] = "value"
+            i += 1
+        else:
+            m = bareword_pattern.match(s, i)
+            if not m:
+                # 单独出现的/
+                emit(c)
+                i += 1
+                continue
+            token, i = m.group(), m.end()
+            cur = begin_value()
+            if stack and cur[0] == "{" and cur[1] == "key":
+                emit(json.dumps(token, ensure_ascii=False))
+                repairs.add("unquoted_key")
+            else:
+                if token in python_literals:
+                    token = python_literals[token]
+                    repairs.add("python_literal")
+                elif token[-1] == "." and token[:-1].replace("-", "").isdigit():
+                    token = token[:-1]
+                    repairs.add("number")
+                emit(token)
+            end_value(cur)
+
+    while stack:
+        repairs.add("unclosed_bracket")
+        close_container()
+    return "".join(out), sorted(repairs)
+
+
 def clean_json_str(s):
     """
-    将json字符串中的一些基本错误改掉：
-        1.将json中的所有中文标点符号全部替换为英文
-        2.将json’{‘到第一个开头的所有字符串都去掉。将“}“到最后一个字符串之间的所有标点符号都去掉
+    将json字符串中的一些基本错误改掉，见repair_json_str
     """
-    # 将所有中文标点转换为英文标点
-    s = unicodedata.normalize('NFKC', s).replace("。", "").replace("【", "").replace("】", "")
-    # 将首位的{和第一个字符串之间的空格换行去掉，并且给末尾没有标点符号的增加逗号
-    s = "}".join([i.strip() for i in "{".join([i.strip() for i in s.split("{")]).split("}")]).replace('\"\n', '\",\n').replace("\'\n", "\',\n")
-    # 将json’{‘到第一个开头的所有字符串都去掉。将“}“到最后一个字符串之间的所有标点符号都去掉
-    s = "}".join([i[:-1] if i and i[-1] in ",，.。" else i for i in "".join(s.split()).split("}")])
-    # 将每个key后面回答的//注释去掉
-    s = "{" + "\n".join([line.split("//")[0].strip() for line in s.strip()[1:-1].split("\n")]) + "}"
-    return s
+    return repair_json_str(s)[0]
 
 
 def parse_json_list(json_list):
@@ -97,59 +269,363 @@ def find_most_confidence_id(d, model_order):
     return sorted(r.items(), key=lambda x: model_order.index(x[0]))[0][1]
 
 
+def scan_json_spans(string, bracket='{}'):
+    """
+    单次扫描找出所有最外层的括号区间，与get_json不同的是会跳过字符串字面量（含转义）中的括号
+    Returns:
+        spans: [(start, end)]，string[start: end]为候选json串
+        unclosed: 未闭合的左括号位置
+    """
+    spans, stack = [], []
+    if bracket[0] not in string:
+        return spans, stack
+    key = ("str", bracket)
+    if key not in bracket_patterns:
+        bracket_patterns[key] = re.compile("[" + re.escape(bracket) + '"\\\\]')
+    in_string, skip_to = False, -1
+    for m in bracket_patterns[key].finditer(string):
+        i = m.start()
+        if i < skip_to:
+            continue
+        c = string[i]
+        if in_string:
+            if c == "\\":
+                skip_to = i + 2
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = bool(stack)
+        elif c == bracket[0]:
+            stack.append(i)
+        elif c == bracket[1] and stack:
+            start = stack.pop()
+            if not stack:
+                spans.append((start, i + 1))
+    return spans, stack
+
+
+def parse_json_candidate(json_str):
+    """解析一个候选json串，失败时用clean_json_str修复后再解析一次
+    Returns:
+        (obj, cleaned)，修复后仍然失败则obj为None
+    """
+    try:
+        return json.loads(json_str), False
+    except (JSONDecodeError, ValueError):
+        pass
+    try:
+        return json.loads(clean_json_str(json_str)), True
+    except Exception:
+        return None, True
+
+
+def iter_json_spans(string, bracket='{}'):
+    """
+    逐个产出response中的json候选及其解析结果，每个候选只解析一次
+    Yields:
+        (start, end, obj)，obj为解析结果，解析失败为None
+    """
+    spans, _ = scan_json_spans(string, bracket)
+    for start, end in spans:
+        yield start, end, parse_json_candidate(string[start: end])[0]
+
+
+class JsonStreamParser:
+    """
+    流式大模型输出的增量json解析，用法：
+        >>> parser = JsonStreamParser()
+        >>> for chunk in stream:
+        >>>     for res in parser.feed(chunk):
+        >>>         ...  # res与parse_json_first的输出格式一致，locate为在完整response中的位置
+        >>> parser.close()  # 返回未闭合json的failed结果
+    说明：
+        - feed只扫描新增的chunk，跨调用保留括号栈、字符串和转义状态，每个chunk的处理量为O(len(chunk))
+        - 最外层json的右括号一到就立即解析返回，与scan_json_spans一样会跳过字符串字面量中的括号
+        - 只缓存当前未闭合json的文本，json之外的文本直接丢弃
+    """
+    def __init__(self, bracket='{}'):
+        self.bracket = bracket
+        self.pattern = re.compile("[" + re.escape(bracket) + '"\\\\]')
+        self.depth, self.in_string, self.skip_next = 0, False, False
+        self.offset, self.start, self.parts = 0, None, []
+
+    def feed(self, chunk):
+        res = []
+        seg_start, skip_to = 0, 1 if self.skip_next else -1
+        self.skip_next = False
+        for m in self.pattern.finditer(chunk):
+            i = m.start()
+            if i < skip_to:
+                continue
+            c = chunk[i]
+            if self.in_string:
+                if c == "\\":
+                    skip_to = i + 2
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = self.depth > 0
+            elif c == self.bracket[0]:
+                if self.depth == 0:
+                    self.start, seg_start, self.parts = self.offset + i, i, []
+                self.depth += 1
+            elif c == self.bracket[1] and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.parts.append(chunk[seg_start: i + 1])
+                    obj, cleaned = parse_json_candidate("".join(self.parts))
+                    self.parts = []
+                    locate = [self.start, self.offset + i + 1]
+                    if isinstance(obj, dict):
+                        res.append({"succ": True, "json": obj, "error_msg": "clean" if cleaned else "", "locate": locate})
+                    else:
+                        res.append({"succ": False, "json": {}, "error_msg": "except", "locate": locate})
+        if skip_to > len(chunk):
+            self.skip_next = True
+        if self.depth > 0:
+            self.parts.append(chunk[seg_start:])
+        self.offset += len(chunk)
+        return res
+
+    def close(self):
+        """结束输入，存在未闭合的json时返回failed结果
+        """
+        res = []
+        if self.depth > 0:
+            res.append({"succ": False, "json": {}, "error_msg": "failed", "locate": [self.start, self.offset]})
+        self.depth, self.in_string, self.skip_next, self.parts = 0, False, False, []
+        return res
+
+
 def parse_json_first(x: str):
     """将response中的json串解析出来，仅支持解析出一个，如果存在多个，将会解析出key最多的一个
     """
-    res_list, error_msg = get_json(x)
-    try:
-        if len(res_list) == 0 and len(error_msg) == 0:
-            return {"succ": False, "json": {}, "error_msg": "nullkey", "locate": []}
-        elif len(error_msg) != 0:
-            return {"succ": False, "json": {}, "error_msg": "failed", "locate": []}
-        else:
-            if len(res_list) == 1:
-                json_str = res_list[0]
-                start_id = x.find(json_str)
-                return {"succ": True, "json": json.loads(json_str), "error_msg": "", "locate": [start_id, start_id + len(json_str)]}
-            else:
-                tmp_json_list = [json.loads(res) for res in res_list]
-                tmp_json = sorted(tmp_json_list, key=lambda x: len(x.keys()))[-1]
-                tmp_json_str = sorted(res_list, key=lambda x: len(json.loads(x).keys()))[-1]
-                start_id = x.find(tmp_json_str)
-                return {"succ": True, "json": tmp_json, "error_msg": "multi", "locate": [start_id, start_id + len(tmp_json_str)]}      
-    except JSONDecodeError as e:
-        try:
-            tmp_json_list = [json.loads(clean_json_str(res)) for res in res_list]
-            tmp_json = sorted(tmp_json_list, key=lambda x: len(x.keys()))[-1]
-            tmp_json_str = sorted(res_list, key=lambda x: len(json.loads(x).keys()))[-1]
-            start_id = x.find(tmp_json_str)
-            return {"succ": True, "json": tmp_json, "error_msg": "clean", "locate": [start_id, start_id + len(tmp_json_str)]}
-        except:
-            return {"succ": False, "json": {i: d for i, d in enumerate(res_list)}, "error_msg": "except", "locate": []}
-    except:
-        return {"succ": False, "json": {i: d for i, d in enumerate(res_list)}, "error_msg": "except", "locate": []}
+    spans, unclosed = scan_json_spans(x)
+    if len(spans) == 0 and len(unclosed) == 0:
+        return {"succ": False, "json": {}, "error_msg": "nullkey", "locate": []}
+    elif len(unclosed) != 0:
+        return {"succ": False, "json": {}, "error_msg": "failed", "locate": []}
+    parsed = [(start, end) + parse_json_candidate(x[start: end]) for start, end in spans]
+    if any(not isinstance(obj, dict) for _, _, obj, _ in parsed):
+        return {"succ": False, "json": {i: x[start: end] for i, (start, end) in enumerate(spans)}, "error_msg": "except", "locate": []}
+    # key数相同时取最后一个
+    start, end, obj, _ = max(reversed(parsed), key=lambda x: len(x[2]))
+    if any(cleaned for _, _, _, cleaned in parsed):
+        error_msg = "clean"
+    else:
+        error_msg = "multi" if len(parsed) > 1 else ""
+    return {"succ": True, "json": obj, "error_msg": error_msg, "locate": [start, end]}
 
     
+def build_peq(pattern):
+    """bit-parallel编辑距离用的字符位图：字符c在pattern的第i位出现，则peq[c]的第i个bit为1
+    """
+    peq = {}
+    for i, c in enumerate(pattern):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    return peq
+
+
+def bit_parallel_edit_distance(peq, m, text, max_dist):
+    """
+    Myers bit-parallel编辑距离，pattern长度为m，每个text字符只需要常数次整数位运算
+    一旦确定距离不会小于max_dist就提前终止并返回max_dist
+    """
+    if m == 0:
+        return min(len(text), max_dist)
+    mask, high = (1 << m) - 1, 1 << (m - 1)
+    pv, mv, score, n = mask, 0, m, len(text)
+    for j, c in enumerate(text):
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        # 剩余每个字符最多让距离减1
+        if score - (n - j - 1) >= max_dist:
+            return max_dist
+    return score
+
+
+class KeyMatcher:
+    """
+    由standard_keys构建一次的key模糊匹配器，匹配结果与逐个计算min_edit_distance取argmin一致：
+        - 完全匹配的key直接返回
+        - 每个standard key的字符位图预先计算好，用bit-parallel编辑距离
+        - 长度差是编辑距离的下界，不可能更优的standard key直接跳过，计算中途确定不会更优也提前终止
+        - 匹配过的key缓存结果，反复出现的错误key只计算一次，缓存超过cache_size时清空
+    """
+    def __init__(self, standard_keys, cache_size=100000):
+        self.standard_keys = list(standard_keys)
+        self.exact = {}
+        for k in self.standard_keys:
+            self.exact.setdefault(k, k)
+        self.peqs = [(build_peq(k), len(k)) for k in self.standard_keys]
+        self.cache, self.cache_size = {}, cache_size
+
+    def match(self, key):
+        """返回(most_likly_key, distance)
+        """
+        if key in self.exact:
+            return key, 0
+        if key in self.cache:
+            return self.cache[key]
+        best_id, best = 0, float("inf")
+        for i, (peq, m) in enumerate(self.peqs):
+            if abs(m - len(key)) >= best:
+                continue
+            dist = bit_parallel_edit_distance(peq, m, key, best)
+            if dist < best:
+                best_id, best = i, dist
+        res = (self.standard_keys[best_id], best)
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[key] = res
+        return res
+
+    def match_all(self, keys):
+        """一次匹配一个response的所有key，返回{key: most_likly_key}
+        """
+        return {k: self.match(k)[0] for k in keys}
+
+    def repair(self, x: dict):
+        """同parse_json_second
+        """
+        err_msg = []
+        new_res = {}
+        key_map = self.match_all(x.keys())
+        for k, v in x.items():
+            most_likly_keys = key_map[k]
+            new_res[most_likly_keys] = v
+            if most_likly_keys != k:
+                err_msg.append(f"key错误, key='{k}', most_likly_keys='{most_likly_keys}'")
+
+        for k in self.standard_keys:
+            if k not in new_res:
+                new_res[k] = 0
+                err_msg.append(f"key缺失, key='{k}'")
+
+        return new_res, ";".join(err_msg)
+
+
+key_matchers = {}
+
+
+def get_key_matcher(standard_keys):
+    key = tuple(standard_keys)
+    if key not in key_matchers:
+        key_matchers[key] = KeyMatcher(standard_keys)
+    return key_matchers[key]
+
+
 def parse_json_second(x: dict, standard_keys: list):
     """第二步解析，解析成json k：v，k为我们要求的key，假如有key没有对上，则用编辑最小距离替代
+    同一组standard_keys的KeyMatcher只构建一次
     """
-    err_msg = []
-    gpt_res_keys = list(x.keys())
-    
-    new_res = {}
-    for k, v in x.items():
-        most_likly_keys = standard_keys[np.argmin([min_edit_distance(k, s) for s in standard_keys])]
-        new_res[most_likly_keys] = v
-        
-        if most_likly_keys != k:
-            err_msg.append(f"key错误, key='{k}', most_likly_keys='{most_likly_keys}'")
-    
-    for k in standard_keys:
-        if k not in new_res:
-            new_res[k] = 0
-            err_msg.append(f"key缺失, key='{k}'")
-    
-    return new_res, ";".join(err_msg)
+    return get_key_matcher(standard_keys).repair(x)
+
+
+class ParseCache:
+    """
+    parse_response_json结果的memo缓存，key为(response, standard_keys)的blake2b hash：
+        - 内存层为有界LRU，存pickle后的结果，命中时反序列化，调用方修改返回结果不会污染缓存
+        - disk_path不为空时增加sqlite磁盘层，内存未命中时查磁盘，离线重复评估同一批语料可以直接跳过解析，
+          写入先缓存，每flush_size条或flush()、进程退出时提交
+        - stats: hits为内存命中数，disk_hits为磁盘命中数，misses为未命中数
+        - 内存LRU和stats都是进程内的，子进程中的修改不会回到主进程；
+          parse_response_json_batch多进程时在主进程查询和写入缓存，子进程不使用缓存
+    """
+    def __init__(self, maxsize=100000, disk_path=None, flush_size=1000):
+        self.maxsize, self.disk_path, self.flush_size = maxsize, disk_path, flush_size
+        self.data = OrderedDict()
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+        self.lock = threading.Lock()
+        self.conn, self.pid, self.pending = None, None, []
+
+    @staticmethod
+    def make_key(x, standard_keys=None):
+        h = hashlib.blake2b(x.encode("utf-8", "surrogatepass"), digest_size=16)
+        h.update(b"\0" + json.dumps(list(standard_keys or []), ensure_ascii=False).encode("utf-8"))
+        return h.hexdigest()
+
+    def connect(self):
+        # fork出的子进程不能复用父进程的sqlite连接
+        if self.disk_path and self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.disk_path, check_same_thread=False, timeout=60)
+            self.conn.execute("CREATE TABLE IF NOT EXISTS parse_cache (key TEXT PRIMARY KEY, value BLOB)")
+            self.pid, self.pending = os.getpid(), []
+        return self.conn
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+                self.stats["hits"] += 1
+                return pickle.loads(value)
+            conn = self.connect()
+            row = conn.execute("SELECT value FROM parse_cache WHERE key = ?", (key,)).fetchone() if conn else None
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._put_memory(key, row[0])
+            return pickle.loads(row[0])
+
+    def _put_memory(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def put(self, key, res):
+        value = pickle.dumps(res)
+        with self.lock:
+            self._put_memory(key, value)
+            if self.connect():
+                self.pending.append((key, value))
+                if len(self.pending) >= self.flush_size:
+                    self._flush()
+
+    def _flush(self):
+        if self.conn is not None and self.pending and self.pid == os.getpid():
+            self.conn.executemany("INSERT OR REPLACE INTO parse_cache VALUES (?, ?)", self.pending)
+            self.conn.commit()
+            self.pending = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+
+parse_cache = None
+
+
+def enable_parse_cache(maxsize=100000, disk_path=None):
+    """开启parse_response_json的memo缓存，返回ParseCache，可以通过其stats查看命中情况
+    """
+    global parse_cache
+    disable_parse_cache()
+    parse_cache = ParseCache(maxsize=maxsize, disk_path=disk_path)
+    return parse_cache
+
+
+def disable_parse_cache():
+    global parse_cache
+    if parse_cache is not None:
+        parse_cache.flush()
+    parse_cache = None
+
+
+atexit.register(disable_parse_cache)
 
 
 def parse_response_json(x, standard_keys: list = None):
@@ -170,7 +646,19 @@ def parse_response_json(x, standard_keys: list = None):
             - error_msg为报错信息
             - locate为定位到的json在原文中的位置[start_id, end_id]
             - repair_dict为编辑距离修正后的dict
+        - 调用enable_parse_cache后会先查询缓存，见ParseCache
     """
+    if parse_cache is not None and isinstance(x, str):
+        key = ParseCache.make_key(x, standard_keys)
+        res = parse_cache.get(key)
+        if res is None:
+            res = parse_response_json_nocache(x, standard_keys)
+            parse_cache.put(key, res)
+        return res
+    return parse_response_json_nocache(x, standard_keys)
+
+
+def parse_response_json_nocache(x, standard_keys: list = None):
     res = parse_json_first(x)
     
     if not res["succ"]:
@@ -180,3 +668,75 @@ def parse_response_json(x, standard_keys: list = None):
         res["json"] = repair_dict
         res["error_msg"] += f"\nstage2 err msg: {err_msg}"
     return res
+
+
+
+null_response_res = {"succ": False, "json": {}, "error_msg": "nullkey", "locate": []}
+
+
+def parse_response_json_chunk(texts, standard_keys: list = None, use_cache=True):
+    parse = parse_response_json if use_cache else parse_response_json_nocache
+    return [parse(x, standard_keys) if isinstance(x, str) else dict(null_response_res) for x in texts]
+
+
+def parse_response_json_cached_batch(texts, standard_keys, workers, chunk_size):
+    """开启缓存时的多进程批量解析：缓存的查询和写入都在主进程完成，子进程只解析未命中的去重后文本
+    """
+    res, todo = [None] * len(texts), {}
+    for i, x in enumerate(texts):
+        if not isinstance(x, str):
+            res[i] = dict(null_response_res)
+            continue
+        key = ParseCache.make_key(x, standard_keys)
+        if key in todo:
+            todo[key].append(i)
+            continue
+        cached = parse_cache.get(key)
+        if cached is None:
+            todo[key] = [i]
+        else:
+            res[i] = cached
+    keys = list(todo)
+    if keys:
+        parse_chunk = partial(parse_response_json_chunk, standard_keys=standard_keys, use_cache=False)
+        parsed = parall_fun(parse_chunk, [texts[todo[key][0]] for key in keys], workers, fun_type="list_sample", chunk_size=chunk_size, backend="process")
+        for key, r in zip(keys, parsed):
+            parse_cache.put(key, r)
+            for j, i in enumerate(todo[key]):
+                res[i] = r if j == 0 else pickle.loads(pickle.dumps(r))
+    parse_cache.flush()
+    return res
+
+
+def parse_response_json_batch(series, standard_keys: list = None, workers=1, chunk_size=None):
+    """按列批量解析response，多进程并行，返回列式结果
+
+    Arguments:
+        series {[pd.Series|list[str]]} -- [大模型response列，非字符串（如NaN）按nullkey处理]
+        standard_keys {[list[str]]} -- [可选，同parse_response_json]
+        workers {[int]} -- [进程数，大于1时使用常驻进程池按chunk并行] (default: {1})
+        chunk_size {[int]} -- [每个进程任务的条数，默认切成workers*4份]
+
+    Returns:
+        [pd.DataFrame] -- [index与series一致，列为：succ、error_msg、locate，
+            传入standard_keys时每个standard key一列（解析失败为None），否则为json一列]
+    """
+    texts = series.tolist() if isinstance(series, pd.Series) else list(series)
+    parse_chunk = partial(parse_response_json_chunk, standard_keys=standard_keys)
+    if workers > 1 and len(texts) > 1 and parse_cache is not None:
+        res = parse_response_json_cached_batch(texts, standard_keys, workers, chunk_size)
+    elif workers > 1 and len(texts) > 1:
+        res = parall_fun(parse_chunk, texts, workers, fun_type="list_sample", chunk_size=chunk_size, backend="process")
+    else:
+        res = parse_chunk(texts)
+    columns = {
+        "succ": [r["succ"] for r in res], 
+        "error_msg": [r["error_msg"] for r in res], 
+        "locate": [r["locate"] for r in res]
+    }
+    if standard_keys:
+        for k in standard_keys:
+            columns[k] = [r["json"].get(k) if r["succ"] else None for r in res]
+    else:
+        columns["json"] = [r["json"] for r in res]
+    return pd.DataFrame(columns, index=series.index if isinstance(series, pd.Series) else None)
@@ -1,13 +1,20 @@
+import io
 import os
 import json
+import mmap
+import shutil
+import tempfile
 from typing import Optional, List, Dict, Any, Union
 from glob import glob
+import numpy as np
 import pandas as pd
 from . import oss_util, hdfs_util, pangu_util, print_util
-from .multi_processor_util import parall_fun, partial
+from .str_parser import str2dayno, expand_braces
+from .common_utils import compile_dot_path, drop_key_path, keep_key_paths
+from .multi_processor_util import parall_fun, iparall_fun, partial, stable_hash
 
 
-def read_dataframe(path, header=0, sheet=0, sep="\t", doc_sep=None, nrows=None, fmt=None):
+def read_dataframe(path, header=0, sheet=0, sep="\t", doc_sep=None, nrows=None, fmt=None, parse_workers=0, chunk_bytes=256 << 20):
     """
     Arguments:
         path {[str]} -- [读取文件的路径，支持格式：xlsx、json[jsonl]、parquet、pickle、csv[其他格式]]
@@ -15,6 +22,9 @@ def read_dataframe(path, header=0, sheet=0, sep="\t", doc_sep=None, nrows=None,
     Keyword Arguments:
         header {int|List[str]} -- [columns，仅对xlsx、csv格式有效，可以是数字代表第几行，可以是list，代表直接输入columns] (default: {0})
         sheet {int|str} -- [sheet名称，仅对xlsx] (default: {0})
+        parse_workers {int} -- [大于1时，超过chunk_bytes的csv、jsonl单文件按换行对齐的字节区间切分，多进程并行解析后按顺序拼接，
+            设置nrows时仍然顺序读取前nrows行；要求字段内没有换行] (default: {0})
+        chunk_bytes {int} -- [并行解析时每个字节区间的大小] (default: {256MB})
     """
     if header is None:
         _header, _names = None, None
@@ -24,7 +34,12 @@ def read_dataframe(path, header=0, sheet=0, sep="\t", doc_sep=None, nrows=None,
         _header, _names = None, header
     else:
         raise Exception("[ERROR] header only support int or list, got {}.".format(str(type(header))))
-    fmt = fmt.lower() or path.split("/")[-1].split(".")[-1].lower()
+    fmt = (fmt or path.split("/")[-1].split(".")[-1]).lower()
+    if parse_workers > 1 and nrows is None and not doc_sep and fmt not in ['xlsx', 'parquet', 'pickle'] and os.path.getsize(path) > chunk_bytes:
+        if fmt not in ['json', 'jsonl']:
+            return read_csv_parallel(path, _header, _names, sep, parse_workers, chunk_bytes)
+        elif is_json_lines(path):
+            return read_jsonl_parallel(path, parse_workers, chunk_bytes)
     if fmt == 'xlsx':
         sheets = [sheet] if not isinstance(sheet, list) else sheet
         df = pd.concat([pd.read_excel(path, header=_header, names=_names, sheet_name=sheet, nrows=nrows) for sheet in sheets]).reset_index(drop=True)
@@ -50,12 +65,69 @@ def read_dataframe(path, header=0, sheet=0, sep="\t", doc_sep=None, nrows=None,
     return df
 
 
+def is_json_lines(path):
+    """第一行是完整的json对象则认为是jsonl
+    """
+    with open(path, "rb") as f:
+        line = f.readline()
+    try:
+        return isinstance(json.loads(line), dict)
+    except ValueError:
+        return False
+
+
+def read_csv_range(task, sep="\t", names=None, dtype=None):
+    path, start, stop = task
+    return pd.read_csv(io.BytesIO(read_byte_range(path, start, stop)), sep=sep, header=None, names=names, dtype=dtype)
+
+
+def read_jsonl_range(task):
+    path, start, stop = task
+    return pd.DataFrame([json.loads(line) for line in read_byte_range(path, start, stop).splitlines() if line.strip()])
+
+
+def read_csv_parallel(path, header, names, sep, workers, chunk_bytes):
+    """单个大csv按字节区间并行解析，header行只在主进程读取一次，数据从header之后的字节开始切分
+    """
+    data_start = 0
+    if header is not None:
+        with open(path, "rb") as f:
+            for _ in range(header + 1):
+                f.readline()
+            data_start = f.tell()
+        names = list(pd.read_csv(path, sep=sep, header=header, nrows=0).columns)
+    tasks = [(path, start, stop) for start, stop in split_byte_ranges(path, chunk_bytes, start=data_start)]
+    if not tasks:
+        return pd.DataFrame(columns=names)
+    k = min(workers, len(tasks))
+    res = parall_fun(partial(read_csv_range, sep=sep, names=names), tasks, k=k, backend="process", chunk_size=1)
+    # 某列只在部分区间被推断为字符串时，其余区间按字符串重新解析，保证和整体读取的结果一致
+    is_str = lambda dtype: pd.api.types.is_object_dtype(dtype) or pd.api.types.is_string_dtype(dtype)
+    str_cols = [c for c in res[0].columns if any(is_str(df[c].dtype) for df in res) and not all(is_str(df[c].dtype) for df in res)]
+    if str_cols:
+        redo = [i for i, df in enumerate(res) if any(not is_str(df[c].dtype) for c in str_cols)]
+        fun = partial(read_csv_range, sep=sep, names=names, dtype={c: str for c in str_cols})
+        for i, df in zip(redo, parall_fun(fun, [tasks[i] for i in redo], k=min(k, len(redo)), backend="process", chunk_size=1)):
+            res[i] = df
+    return pd.concat(res, ignore_index=True)
+
+
+def read_jsonl_parallel(path, workers, chunk_bytes):
+    tasks = [(path, start, stop) for start, stop in split_byte_ranges(path, chunk_bytes)]
+    res = parall_fun(read_jsonl_range, tasks, k=min(workers, len(tasks)), backend="process", chunk_size=1)
+    return pd.concat(res, ignore_index=True)
+
+
 def mkdir(local_root):
     if not os.path.exists(local_root) and os.system("mkdir -p %s" % local_root) != 0:
         raise Exception("[ERROR] System mkdir error, path=`{}`".format(local_root))
 
 
-def read_file_single(data_path, header=0, sheet=0, local_root=".cache", sep="\t", doc_sep=None, read_cache=True, nrows=None, fmt=None):
+def cache_file(data_path, local_root=".cache", read_cache=True):
+    """远程文件（oss、hdfs、pangu）下载到local_root下，返回本地路径，本地文件直接返回
+    """
+    if not data_path.startswith(("oss://", "hdfs://", "pangu://")):
+        return data_path
     mkdir(local_root)
     local_root = os.path.join(local_root, '/'.join(os.path.dirname(data_path).split("/")[3:]))
     mkdir(local_root)
@@ -65,39 +137,480 @@ def read_file_single(data_path, header=0, sheet=0, local_root=".cache", sep="\t"
         if is_download:
             print("[INFO] 下载成功, oss_file: {}, local_file: {}\n".format(data_path, local_file), end="")
     elif data_path.startswith("hdfs://"):
-        hdfs_util.download_file(data_path, local_file)
-        print("[INFO] 下载成功, hdfs_file: {}, local_file: {}\n".format(data_path, local_file), end="")
+        if hdfs_util.download_file(data_path, local_file, redownload=not read_cache):
+            print("[INFO] 下载成功, hdfs_file: {}, local_file: {}\n".format(data_path, local_file), end="")
     elif data_path.startswith("pangu://"):
         pangu_util.download_file(data_path, local_file)
         print("[INFO] 下载成功, pangu_file: {}, local_file: {}\n".format(data_path, local_file), end="")
+    return local_file
+
+
+def read_file_single(data_path, header=0, sheet=0, local_root=".cache", sep="\t", doc_sep=None, read_cache=True, nrows=None, fmt=None, parse_workers=0):
+    local_file = cache_file(data_path, local_root, read_cache=read_cache)
+    return read_dataframe(local_file, header, sheet, sep, doc_sep=doc_sep, nrows=nrows, fmt=fmt, parse_workers=parse_workers)
+
+
+def split_byte_ranges(path, chunk_bytes=64 << 20, start=0):
+    """把文件从start开始按chunk_bytes切成[start, stop)字节区间，边界对齐到换行符之后，每个区间都是完整的行
+    """
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path, "rb") as f:
+        while bounds[-1] + chunk_bytes < size:
+            f.seek(bounds[-1] + chunk_bytes - 1)
+            f.readline()
+            if f.tell() >= size:
+                break
+            bounds.append(f.tell())
+    bounds.append(size)
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def read_byte_range(path, start, stop):
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(stop - start)
+
+
+def transform_jsonl_chunk(task, drop_paths=(), keep_paths=(), on_error="raise"):
+    """处理一个字节区间，返回(输出bytes, 输入条数, 输出条数, 错误条数)
+    """
+    path, start, stop = task
+    out, n_in, n_err = [], 0, 0
+    for line in read_byte_range(path, start, stop).splitlines():
+        if not line.strip():
+            continue
+        n_in += 1
+        try:
+            record = json.loads(line)
+        except ValueError:
+            if on_error == "raise":
+                raise Exception("[ERROR] Invalid json line in {} bytes [{}, {}): {}".format(path, start, stop, line[:200]))
+            n_err += 1
+            if on_error == "keep":
+                out.append(line.decode("utf-8", errors="replace"))
+            continue
+        if keep_paths:
+            record = keep_key_paths(record, keep_paths)
+        for key_path in drop_paths:
+            drop_key_path(record, key_path)
+        out.append(json.dumps(record, ensure_ascii=False))
+    data = ("\n".join(out) + "\n").encode("utf-8") if out else b""
+    return data, n_in, len(out), n_err
+
+
+def transform_jsonl(paths, dump_path, drop_keys=None, keep_keys=None, cache_root=".cache", read_cache=True, chunk_bytes=64 << 20, work_num=8, backend="process", on_error="raise", buffer_size=16 << 20):
+    """流式JSONL -> JSONL字段裁剪，不构造DataFrame，适合归档前去掉请求日志中的大字段
+        - paths: globs支持的通配符路径或路径列表，远程文件先下载到cache_root
+        - dump_path: 输出路径，支持hdfs、oss、本地，多个输入按顺序合并为一个输出
+        - drop_keys: 要删除的字段，支持"a.b.c"的嵌套路径
+        - keep_keys: 要保留的字段，同样支持嵌套路径，和drop_keys同时设置时先keep再drop
+        - chunk_bytes: 按字节区间切分任务，多进程并行处理，结果按输入顺序写出
+        - on_error: 非法json行的处理方式，raise报错，skip丢弃，keep原样保留
+        - buffer_size: 输出文件写缓冲大小
+    """
+    assert drop_keys or keep_keys, "[ERROR] drop_keys or keep_keys is required"
+    if on_error not in ["raise", "skip", "keep"]:
+        raise Exception(f"[ERROR] Unknown on_error = '{on_error}', expect ['raise', 'skip', 'keep']")
+    if isinstance(paths, str):
+        paths = globs(paths)
+        print("[INFO] Match read files:")
+        print_util.print_paths(paths)
+    assert paths, "[ERROR] Got empty paths!"
+
+    local_files = [cache_file(p, cache_root, read_cache=read_cache) for p in paths]
+    assert os.path.abspath(dump_path) not in [os.path.abspath(p) for p in local_files], "[ERROR] dump_path can not be one of the input files"
+    tasks = [(p, start, stop) for p in local_files for start, stop in split_byte_ranges(p, chunk_bytes)]
+    fun = partial(
+        transform_jsonl_chunk, on_error=on_error,
+        drop_paths=[compile_dot_path(k) for k in drop_keys or []], keep_paths=[compile_dot_path(k) for k in keep_keys or []]
+    )
+
+    mkdir(cache_root)
+    tmp_path = os.path.join(cache_root, os.path.basename(dump_path)) if dump_path.startswith(("oss://", "hdfs://")) else dump_path
+    if os.path.dirname(tmp_path):
+        os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+    n_in, n_out, n_err = 0, 0, 0
+    with open(tmp_path, "wb", buffering=buffer_size) as f:
+        for data, a, b, c in iparall_fun(fun, tasks, k=max(1, work_num), backend=backend):
+            f.write(data)
+            n_in, n_out, n_err = n_in + a, n_out + b, n_err + c
+
+    if dump_path.startswith("oss://"):
+        oss_util.upload_file(tmp_path, dump_path)
+    elif dump_path.startswith("hdfs://"):
+        hdfs_util.upload_file(tmp_path, dump_path)
+    if n_err:
+        print("[WARNING] Invalid json lines: {}, on_error={}".format(n_err, on_error))
+    print("[INFO] Transform success: {}, input lines: {}, output lines: {}".format(dump_path, n_in, n_out))
+    return n_out
+
+
+def line_index_file(local_file, cache_root=".cache"):
+    """行偏移索引的存储路径，.cache中的文件存在同目录的隐藏文件中，其他本地文件按绝对路径存在cache_root/line_index下
+    """
+    abs_file, abs_root = os.path.abspath(local_file), os.path.abspath(cache_root)
+    if abs_file.startswith(abs_root + os.sep):
+        root = os.path.dirname(abs_file)
     else:
-        local_file = data_path
-    return read_dataframe(local_file, header, sheet, sep, doc_sep=doc_sep, nrows=nrows, fmt=fmt)
+        root = os.path.join(abs_root, "line_index", os.path.dirname(abs_file).lstrip(os.sep))
+    return os.path.join(root, "." + os.path.basename(abs_file) + ".line_index")
 
 
-def read_file(paths, header=0, sheet=0, cache_root=".cache", sep="\t", doc_sep=None, read_cache=True, nrows=None, fmt=None, work_num=16):
+def file_version(local_file):
+    """本地文件的版本信息，size、mtime以及远端下载时保存的etag/签名，任一变化索引失效
+    """
+    stat = os.stat(local_file)
+    etag = oss_util.read_local_etag(local_file) or hdfs_util.read_local_signature(local_file)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "etag": etag.strip()}
+
+
+def find_newlines(task):
+    path, start, stop = task
+    buf = np.frombuffer(read_byte_range(path, start, stop), dtype=np.uint8)
+    return np.flatnonzero(buf == 10).astype(np.uint64) + np.uint64(start + 1)
+
+
+def build_line_index(local_file, cache_root=".cache", work_num=8, chunk_bytes=256 << 20):
+    """
+    构建或读取行偏移索引，返回每行起始字节位置，最后一个元素为文件大小，即第i行为[offsets[i], offsets[i + 1])
+        - 索引按字节区间并行扫描换行符，结果保存为.npy，版本信息保存为.json
+        - 文件的size、mtime或etag变化时重新构建
+    """
+    index_file = line_index_file(local_file, cache_root)
+    version = file_version(local_file)
+    if os.path.exists(index_file + ".json") and os.path.exists(index_file + ".npy"):
+        with open(index_file + ".json") as f:
+            if json.load(f) == version:
+                return np.load(index_file + ".npy", mmap_mode="r")
+
+    tasks = [(local_file, start, stop) for start, stop in split_byte_ranges(local_file, chunk_bytes)]
+    if len(tasks) > 1 and work_num > 1:
+        res = parall_fun(find_newlines, tasks, k=min(work_num, len(tasks)), backend="process", chunk_size=1)
+    else:
+        res = [find_newlines(task) for task in tasks]
+    size = version["size"]
+    offsets = np.concatenate([np.zeros(1, dtype=np.uint64)] + res)
+    if offsets[-1] != size:
+        # 最后一行没有换行符
+        offsets = np.append(offsets, np.uint64(size))
+
+    os.makedirs(os.path.dirname(index_file), exist_ok=True)
+    np.save(index_file + ".npy", offsets)
+    with open(index_file + ".json", "w") as f:
+        json.dump(version, f)
+    print("[INFO] Line index built: {}, lines: {}".format(index_file, len(offsets) - 1))
+    return offsets
+
+
+def parse_lines(data, fmt, names, sep):
+    if fmt in ['json', 'jsonl']:
+        return pd.DataFrame([json.loads(line) for line in data.splitlines() if line.strip()])
+    return pd.read_csv(io.BytesIO(data), sep=sep, header=None, names=names)
+
+
+def prepare_line_read(path, header, sep, fmt, cache_root, read_cache):
+    local_file = cache_file(path, cache_root, read_cache=read_cache)
+    fmt = (fmt or local_file.split("/")[-1].split(".")[-1]).lower()
+    offsets = build_line_index(local_file, cache_root)
+    skip, names = 0, None
+    if fmt not in ['json', 'jsonl']:
+        if isinstance(header, int):
+            skip, names = header + 1, list(pd.read_csv(local_file, sep=sep, header=header, nrows=0).columns)
+        elif isinstance(header, list):
+            names = header
+    return local_file, fmt, offsets, skip, names
+
+
+def read_rows(path, start, stop, header=0, sep="\t", fmt=None, cache_root=".cache", read_cache=True):
+    """
+    通过行偏移索引读取第[start, stop)行（不含header），不需要从头读取文件
+        - 支持jsonl和按行分割的csv，header、sep同read_dataframe
+        - path支持hdfs、oss、pangu、本地，远程文件先下载到cache_root
+    """
+    local_file, fmt, offsets, skip, names = prepare_line_read(path, header, sep, fmt, cache_root, read_cache)
+    n = len(offsets) - 1 - skip
+    start, stop = max(0, min(start, n)), max(0, min(stop, n))
+    if stop <= start:
+        return pd.DataFrame(columns=names)
+    with open(local_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = mm[int(offsets[start + skip]): int(offsets[stop + skip])]
+    return parse_lines(data, fmt, names, sep)
+
+
+def take(path, indices, header=0, sep="\t", fmt=None, cache_root=".cache", read_cache=True):
+    """
+    通过行偏移索引读取指定的若干行（不含header），按indices的顺序返回，可用于随机抽样
+    """
+    local_file, fmt, offsets, skip, names = prepare_line_read(path, header, sep, fmt, cache_root, read_cache)
+    indices = np.asarray(indices, dtype=np.int64)
+    n = len(offsets) - 1 - skip
+    if len(indices) and (indices.min() < -n or indices.max() >= n):
+        raise IndexError("[ERROR] Line index out of range, lines: {}, got [{}, {}]".format(n, indices.min(), indices.max()))
+    if len(indices) == 0:
+        return pd.DataFrame(columns=names)
+    lines = np.where(indices < 0, indices + n, indices) + skip
+    with open(local_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        data = b"".join([mm[int(offsets[i]): int(offsets[i + 1])].rstrip(b"\r\n") + b"\n" for i in lines])
+    return parse_lines(data, fmt, names, sep)
+
+
+def read_file(paths, header=0, sheet=0, cache_root=".cache", sep="\t", doc_sep=None, read_cache=True, nrows=None, fmt=None, work_num=16, parse_workers=0):
     """通用读取接口，支持\t分割的csv、xlsx、parquet、pickle、json
+        - parse_workers: 单个大文件内部按字节区间并行解析的进程数，见read_dataframe
     """
     if isinstance(paths, list):
         assert paths, "[ERROR] Got empty paths!"
         if work_num > 0:
             work_num = min(len(paths), work_num)
             if len(paths) > 1:
-                parall_read = partial(read_file_single, header=header, sheet=sheet, local_root=cache_root, sep=sep, doc_sep=doc_sep, read_cache=read_cache, nrows=nrows, fmt=fmt)
+                parall_read = partial(read_file_single, header=header, sheet=sheet, local_root=cache_root, sep=sep, doc_sep=doc_sep, read_cache=read_cache, nrows=nrows, fmt=fmt, parse_workers=parse_workers)
                 res = parall_fun(parall_read, paths, k=work_num)
                 df = pd.concat(res).reset_index(drop=True)
             else:
-                df = read_file_single(paths[0], header, sheet, cache_root, sep, doc_sep=doc_sep, read_cache=read_cache, nrows=nrows, fmt=fmt)
+                df = read_file_single(paths[0], header, sheet, cache_root, sep, doc_sep=doc_sep, read_cache=read_cache, nrows=nrows, fmt=fmt, parse_workers=parse_workers)
         else:
-            df = pd.concat([read_file_single(p, header, sheet, cache_root, sep, doc_sep=doc_sep, read_cache=read_cache, nrows=nrows, fmt=fmt) for p in paths]).reset_index(drop=True)
+            df = pd.concat([read_file_single(p, header, sheet, cache_root, sep, doc_sep=doc_sep, read_cache=read_cache, nrows=nrows, fmt=fmt, parse_workers=parse_workers) for p in paths]).reset_index(drop=True)
     elif isinstance(paths, str):
-        df = read_file_single(paths, header, sheet, cache_root, sep, doc_sep=doc_sep, read_cache=read_cache, nrows=nrows, fmt=fmt)
+        df = read_file_single(paths, header, sheet, cache_root, sep, doc_sep=doc_sep, read_cache=read_cache, nrows=nrows, fmt=fmt, parse_workers=parse_workers)
     else:
         raise Exception("[ERROR] Unknown type of input path, expect `str` or `List[str]`, got {}".format(str(type(paths))))
     print("[INFO] Got dataframe, df data nums: {}".format(len(df)))
     return df
 
 
+def iter_dataframe(local_file, header=0, sheet=0, sep="\t", doc_sep=None, fmt=None, chunk_rows=100000):
+    """按chunk_rows流式读取csv、jsonl，其他格式整体读取后返回一个DataFrame
+    """
+    fmt = (fmt or local_file.split("/")[-1].split(".")[-1]).lower()
+    if fmt in ['json', 'jsonl'] and is_json_lines(local_file):
+        yield from pd.read_json(local_file, lines=True, chunksize=chunk_rows)
+    elif fmt in ['json', 'jsonl', 'xlsx', 'parquet', 'pickle'] or doc_sep:
+        yield read_dataframe(local_file, header, sheet, sep, doc_sep=doc_sep, fmt=fmt)
+    else:
+        _header, _names = (None, header) if isinstance(header, list) else (header, None)
+        yield from pd.read_csv(local_file, sep=sep, header=_header, names=_names, chunksize=chunk_rows)
+
+
+def bottom_k(df, n, stratify=None, key="__sample_key"):
+    """保留key最小的n行，stratify不为空时每层各保留n行
+    """
+    if stratify is None:
+        return df.nsmallest(n, key) if len(df) > n else df
+    return df.sort_values(key).groupby(stratify, dropna=False, sort=False).head(n)
+
+
+def sample_file_single(data_path, sample, seed=0, stratify=None, header=0, sheet=0, local_root=".cache", sep="\t", doc_sep=None, read_cache=True, fmt=None, chunk_rows=100000):
+    """
+    单个文件流式抽样，每行分配一个随机key，返回(样本, 每层行数)
+        - 随机数种子由seed和文件路径决定，与分片的读取顺序、chunk大小无关，结果可复现
+        - sample为int时保留key最小的sample行（每层各sample行），为float时保留key < sample的行
+    """
+    local_file = cache_file(data_path, local_root, read_cache=read_cache)
+    rng = np.random.default_rng(int(stable_hash([seed, data_path])[:16], 16))
+    reservoir, counts = None, None
+    for df in iter_dataframe(local_file, header, sheet, sep, doc_sep=doc_sep, fmt=fmt, chunk_rows=chunk_rows):
+        df = df.assign(__sample_key=rng.random(len(df)))
+        if stratify is not None:
+            count = df[stratify].value_counts(dropna=False)
+            counts = count if counts is None else counts.add(count, fill_value=0)
+        if isinstance(sample, float):
+            df = df[df["__sample_key"] < sample]
+            reservoir = df if reservoir is None else pd.concat([reservoir, df])
+        else:
+            reservoir = bottom_k(df if reservoir is None else pd.concat([reservoir, df]), sample, stratify)
+    return reservoir, counts
+
+
+def allocate_quota(counts, n):
+    """按各层行数等比例分配样本数，最大余数法保证总数为n
+    """
+    quota = counts * min(n, counts.sum()) / counts.sum()
+    base = np.floor(quota).astype(int)
+    rest = int(round(quota.sum() - base.sum()))
+    if rest > 0:
+        remainder = (quota - base).sort_values(ascending=False, kind="stable")
+        base[remainder.index[:rest]] += 1
+    return base
+
+
+def sample_files(paths, sample, seed=0, stratify=None, header=0, sheet=0, cache_root=".cache", sep="\t", doc_sep=None, read_cache=True, fmt=None, work_num=16, chunk_rows=100000):
+    """
+    多个分片并行流式抽样后合并，内存只与样本量有关
+        - sample: int为抽样行数（不放回），float为抽样比例
+        - stratify: 分层列，int时按各层行数等比例分配样本数，每个分片每层最多保留sample行；float时每行独立保留，各层天然等比例
+        - 各分片保留key最小的行，合并后再取全局key最小的行，等价于对全部数据均匀抽样
+    """
+    assert (isinstance(sample, int) and sample > 0) or (isinstance(sample, float) and 0 < sample <= 1), "[ERROR] sample must be int > 0 or float in (0, 1], got {}".format(sample)
+    fun = partial(
+        sample_file_single, sample=sample, seed=seed, stratify=stratify, header=header, sheet=sheet, local_root=cache_root,
+        sep=sep, doc_sep=doc_sep, read_cache=read_cache, fmt=fmt, chunk_rows=chunk_rows
+    )
+    if work_num > 0 and len(paths) > 1:
+        res = parall_fun(fun, paths, k=min(len(paths), work_num))
+    else:
+        res = [fun(p) for p in paths]
+    df = pd.concat([r[0] for r in res])
+    if isinstance(sample, int):
+        if stratify is None:
+            df = bottom_k(df, sample)
+        else:
+            counts = pd.concat([r[1] for r in res]).groupby(level=0, dropna=False).sum()
+            quota = allocate_quota(counts, sample)
+            df = pd.concat([g.nsmallest(int(quota.get(name, 0)), "__sample_key") for name, g in df.groupby(stratify, dropna=False, sort=False)])
+    return df.sort_values("__sample_key").drop(columns="__sample_key").reset_index(drop=True)
+
+
+class DedupSet:
+    """
+    紧凑的uint64 hash集合，用于流式去重，每条记录只占8字节
+        - 按hash高位分成num_partitions个分区，每个分区由若干有序段组成，查询时逐段二分查找，段数超过max_segments时合并
+        - 内存中的段超过memory_mb时，各分区合并后写到spill_dir下的磁盘分区文件（np.memmap），之后只读映射查询
+        - stats: rows为输入条数，removed为去掉的重复条数，spills为落盘次数
+    """
+    def __init__(self, memory_mb=1024, spill_dir=".cache/dedup", num_partitions=64, max_segments=8):
+        assert num_partitions & (num_partitions - 1) == 0, "[ERROR] num_partitions must be power of 2"
+        self.memory_bytes, self.spill_root, self.max_segments = memory_mb << 20, spill_dir, max_segments
+        self.shift = np.uint64(64 - num_partitions.bit_length() + 1)
+        self.memory = [[] for _ in range(num_partitions)]
+        self.disk = [[] for _ in range(num_partitions)]
+        self.memory_size, self.spill_dir, self.file_id = 0, None, 0
+        self.stats = {"rows": 0, "removed": 0, "spills": 0}
+
+    @staticmethod
+    def contains(segments, hashes):
+        found = np.zeros(len(hashes), dtype=bool)
+        for seg in segments:
+            pos = np.minimum(np.searchsorted(seg, hashes), len(seg) - 1)
+            found |= np.asarray(seg[pos]) == hashes
+        return found
+
+    def add(self, hashes):
+        """加入一批hash，返回bool mask，True为第一次出现（包括批内重复的第一条）
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        mask = np.zeros(len(hashes), dtype=bool)
+        mask[np.unique(hashes, return_index=True)[1]] = True
+        parts = (hashes >> self.shift).astype(np.intp) if len(self.memory) > 1 else np.zeros(len(hashes), dtype=np.intp)
+        for p in np.unique(parts[mask]):
+            idx = np.flatnonzero(mask & (parts == p))
+            seen = self.contains(self.memory[p] + self.disk[p], hashes[idx])
+            mask[idx[seen]] = False
+            new = np.sort(hashes[idx[~seen]])
+            if len(new):
+                self.memory[p].append(new)
+                self.memory_size += new.nbytes
+                if len(self.memory[p]) > self.max_segments:
+                    self.memory[p] = [np.sort(np.concatenate(self.memory[p]))]
+        self.stats["rows"] += len(hashes)
+        self.stats["removed"] += len(hashes) - int(mask.sum())
+        if self.memory_size > self.memory_bytes:
+            self.spill()
+        return mask
+
+    def write_segment(self, data):
+        if self.spill_dir is None:
+            os.makedirs(self.spill_root, exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(dir=self.spill_root)
+        path = os.path.join(self.spill_dir, "part-{}.u64".format(self.file_id))
+        self.file_id += 1
+        mm = np.memmap(path, dtype=np.uint64, mode="w+", shape=(len(data),))
+        mm[:] = data
+        mm.flush()
+        del mm
+        return np.memmap(path, dtype=np.uint64, mode="r", shape=(len(data),))
+
+    def spill(self):
+        for p, segments in enumerate(self.memory):
+            if segments:
+                self.disk[p].append(self.write_segment(np.sort(np.concatenate(segments))))
+                if len(self.disk[p]) > self.max_segments:
+                    old = self.disk[p]
+                    self.disk[p] = [self.write_segment(np.sort(np.concatenate(old)))]
+                    for seg in old:
+                        os.remove(seg.filename)
+        self.memory = [[] for _ in self.memory]
+        self.memory_size = 0
+        self.stats["spills"] += 1
+
+    def close(self):
+        self.memory = [[] for _ in self.memory]
+        self.disk = [[] for _ in self.disk]
+        if self.spill_dir is not None:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+            self.spill_dir = None
+
+
+def canonical_keys(df, dedup_on):
+    """
+    dedup列统一转为字符串再hash，避免不同分片dtype不一致时相同的值hash不同，例如含空值的整数列会被读成float
+        - 整数值的float转为整数字符串，和int列一致：1.0 -> "1"
+        - 空值统一为同一个标记
+    """
+    keys = {}
+    for c in dedup_on:
+        col = df[c]
+        s = col.astype(str)
+        if pd.api.types.is_float_dtype(col):
+            integral = col.notna() & (col % 1 == 0) & (col.abs() < 2 ** 63)
+            s[integral] = col[integral].astype("int64").astype(str)
+        keys[c] = s.where(col.notna(), "\0null")
+    return pd.DataFrame(keys, index=df.index)
+
+
+def hash_rows(df, dedup_on):
+    """按dedup_on列计算每行的64位hash，不包含index
+    """
+    return pd.util.hash_pandas_object(canonical_keys(df, list(dedup_on)), index=False).to_numpy(dtype=np.uint64)
+
+
+def dedup_frame(df, dedup_on):
+    """内存中的DataFrame按dedup_on去重，保留第一次出现的行，返回(去重后的DataFrame, 去掉的行数)
+    """
+    mask = DedupSet(memory_mb=1 << 20, num_partitions=1).add(hash_rows(df, dedup_on))
+    return df[mask], int(len(mask) - mask.sum())
+
+
+def dedup_file_single(data_path, dedup_on, header=0, sheet=0, local_root=".cache", sep="\t", doc_sep=None, read_cache=True, fmt=None, chunk_rows=100000):
+    """
+    单个文件流式读取并在文件内去重，返回(去重后的DataFrame, 对应的hash, 输入行数)，跨文件去重由调用方完成
+    """
+    local_file = cache_file(data_path, local_root, read_cache=read_cache)
+    dedup, frames, hashes = DedupSet(memory_mb=1 << 20, num_partitions=1), [], []
+    for df in iter_dataframe(local_file, header, sheet, sep, doc_sep=doc_sep, fmt=fmt, chunk_rows=chunk_rows):
+        h = hash_rows(df, dedup_on)
+        mask = dedup.add(h)
+        frames.append(df[mask])
+        hashes.append(h[mask])
+    if not frames:
+        return pd.DataFrame(), np.empty(0, dtype=np.uint64), 0
+    return pd.concat(frames, ignore_index=True), np.concatenate(hashes), dedup.stats["rows"]
+
+
+def dedup_files(paths, dedup_on, header=0, sheet=0, cache_root=".cache", sep="\t", doc_sep=None, read_cache=True, fmt=None, work_num=16, memory_mb=1024, chunk_rows=100000):
+    """
+    多个分片流式去重，保留按paths顺序第一次出现的行
+        - 分片并行读取并做文件内去重，再按顺序和全局DedupSet比对，全局只保存每条记录8字节的hash
+        - hash集合超过memory_mb时落盘到cache_root/dedup，结束后删除
+    """
+    dedup_on = [dedup_on] if isinstance(dedup_on, str) else list(dedup_on)
+    dedup = DedupSet(memory_mb=memory_mb, spill_dir=os.path.join(cache_root, "dedup"))
+    fun = partial(
+        dedup_file_single, dedup_on=dedup_on, header=header, sheet=sheet, local_root=cache_root,
+        sep=sep, doc_sep=doc_sep, read_cache=read_cache, fmt=fmt, chunk_rows=chunk_rows
+    )
+    frames, rows = [], 0
+    try:
+        for df, hashes, n in iparall_fun(fun, paths, k=max(1, min(len(paths), work_num))):
+            frames.append(df[dedup.add(hashes)])
+            rows += n
+    finally:
+        dedup.close()
+    df = pd.concat(frames, ignore_index=True)
+    print("[INFO] Dedup on {}, input rows: {}, removed rows: {}, spills: {}".format(dedup_on, rows, rows - len(df), dedup.stats["spills"]))
+    return df
+
+
 def write_text(df, tmp_path, sep, doc_sep):
     with open(tmp_path, "w") as f:
         for line in df.astype(str).values:
@@ -152,7 +665,17 @@ def file_exist(path):
         return os.path.exists(path)
 
 
-def globs(path_pattern):
+def globs(path_pattern, work_num=16):
+    """通配符匹配，支持hdfs、oss、pangu、本地，支持{a,b}花括号展开，展开后的多个pattern并行列举
+    """
+    patterns = expand_braces(path_pattern)
+    if len(patterns) == 1:
+        return glob_single(patterns[0])
+    res = parall_fun(glob_single, patterns, k=min(work_num, len(patterns)), progress=False)
+    return list(dict.fromkeys(p for paths in res for p in paths))
+
+
+def glob_single(path_pattern):
     if path_pattern.startswith("oss://"):
         return oss_util.glob_oss(path_pattern)
     elif path_pattern.startswith("hdfs://"):
@@ -226,7 +749,31 @@ def dump_text(text, path):
     dump_df([str(text)], path)
 
 
-def read_df(paths, header=0, sheet=0, cache_root=".cache", read_cache=True, sep="\t", doc_sep=None, nrows=None, fmt=None, work_num=16):
+def glob_day(path_pattern):
+    """列举一天的分区，glob_pangu、glob_oss在分区目录不存在时报FileNotFoundError，视为该天缺失
+    """
+    try:
+        return globs(path_pattern, work_num=1)
+    except FileNotFoundError:
+        return []
+
+
+def globs_days(path_template, days, work_num=16):
+    """
+    按天分区列举文件，只列举需要的分区，不存在的分区跳过并打印
+        - path_template: 带{dayno}占位符的路径，例如hdfs://xxx/dt={dayno}/part-*
+        - days: str2dayno支持的日期字符串，例如20240101~20240131、20240131-7，或dayno列表
+    """
+    assert "{dayno}" in path_template, "[ERROR] path_template must contain '{{dayno}}', got {}".format(path_template)
+    daynos = str2dayno(days, mode="list") if isinstance(days, str) else list(days)
+    res = parall_fun(glob_day, [path_template.replace("{dayno}", d) for d in daynos], k=max(1, min(work_num, len(daynos))), progress=False)
+    missing = [d for d, paths in zip(daynos, res) if not paths]
+    if missing:
+        print("[WARNING] Missing days: {}/{}, skipped: {}".format(len(missing), len(daynos), ",".join(missing)))
+    return [p for paths in res for p in paths]
+
+
+def read_df(paths, header=0, sheet=0, cache_root=".cache", read_cache=True, sep="\t", doc_sep=None, nrows=None, fmt=None, work_num=16, days=None, parse_workers=0, sample=None, seed=0, stratify=None, dedup_on=None, dedup_memory_mb=1024):
     """统一的读取文件接口:
         - 支持parquet、json、jsonl、csv、xlsx、pickle等格式的读取
         - 支持从hdfs、oss、pangu、本地直接读取
@@ -241,11 +788,24 @@ def read_df(paths, header=0, sheet=0, cache_root=".cache", read_cache=True, sep=
         sep {str} -- [field sep]
         doc_sep {str} -- [line sep]
         work_num {int} -- [multi read to speed up, -1 is unable]
+        parse_workers {int} -- [parse a single large csv/jsonl file with byte ranges in parallel processes, 0 is unable]
+        days {str} -- [day range parsed by str2dayno, e.g. 20240101~20240131, paths must be a template with `{dayno}`, only listing the matched partitions]
+        sample {int|float} -- [streaming sample over all files, int for rows, float for fraction, memory only depends on sample size, see sample_files]
+        seed {int} -- [random seed of sample, same seed and files give the same result]
+        stratify {str} -- [stratify column of sample, the sample size of each stratum is proportional to its rows]
+        dedup_on {str|List[str]} -- [streaming dedup on these columns across files, keeping the first row, see dedup_files]
+        dedup_memory_mb {int} -- [memory budget of the dedup hash set, spilled to `cache_root/dedup` beyond it]
 
     Returns:
         [pandas.DataFrame] -- [Union DataFrame]
     """
-    if isinstance(paths, str):
+    if days is not None:
+        assert isinstance(paths, str), "[ERROR] paths must be a path template when days is set"
+        path_template, paths = paths, globs_days(paths, days, work_num=max(1, work_num))
+        assert paths, "[ERROR] No file matched, template: {}, days: {}".format(path_template, days)
+        print("[INFO] Match read files:")
+        print_util.print_paths(paths)
+    elif isinstance(paths, str):
         paths = globs(paths)
         print("[INFO] Match read files:")
         print_util.print_paths(paths)
@@ -254,10 +814,21 @@ def read_df(paths, header=0, sheet=0, cache_root=".cache", read_cache=True, sep=
         print_util.print_paths(paths)
     else:
         raise Exception("[ERROR] Unknown path, got {}".format(paths))
-    return read_file(paths, header, sheet, cache_root, read_cache=read_cache, sep=sep, doc_sep=doc_sep, nrows=nrows, work_num=work_num, fmt=fmt)
+    if dedup_on:
+        assert paths, "[ERROR] Got empty paths!"
+        assert sample is None, "[ERROR] dedup_on and sample can not be set at the same time"
+        df = dedup_files(paths, dedup_on, header=header, sheet=sheet, cache_root=cache_root, sep=sep, doc_sep=doc_sep, read_cache=read_cache, fmt=fmt, work_num=work_num, memory_mb=dedup_memory_mb)
+        print("[INFO] Got dataframe, df data nums: {}".format(len(df)))
+        return df
+    if sample is not None:
+        assert paths, "[ERROR] Got empty paths!"
+        df = sample_files(paths, sample, seed=seed, stratify=stratify, header=header, sheet=sheet, cache_root=cache_root, sep=sep, doc_sep=doc_sep, read_cache=read_cache, fmt=fmt, work_num=work_num)
+        print("[INFO] Got sample dataframe, df data nums: {}".format(len(df)))
+        return df
+    return read_file(paths, header, sheet, cache_root, read_cache=read_cache, sep=sep, doc_sep=doc_sep, nrows=nrows, work_num=work_num, fmt=fmt, parse_workers=parse_workers)
 
 
-def dump_df(df, dump_path, header: Union[List[int], List[str], bool] = True, split_num=0, cache_root=".cache", sep="\t", doc_sep="\n", url_on=True, sheet="Sheet1"):
+def dump_df(df, dump_path, header: Union[List[int], List[str], bool] = True, split_num=0, cache_root=".cache", sep="\t", doc_sep="\n", url_on=True, sheet="Sheet1", dedup_on=None):
     """统一的保存文件接口:
         - 支持parquet、json、csv、xlsx、pickle等格式的保存
         - 支持直接写入到hdfs、oss、本地
@@ -271,6 +842,7 @@ def dump_df(df, dump_path, header: Union[List[int], List[str], bool] = True, spl
         header {bool} -- [keep header or not] (default: {True})
         split_num {int} -- [split num] (default: {0})
         cache_root {str} -- [cache root] (default: {".cache"})
+        dedup_on {str|List[str]} -- [dedup on these columns before saving, keeping the first row] (default: {None})
     """
     if isinstance(df, list):
         df = pd.DataFrame(df)
@@ -278,6 +850,11 @@ def dump_df(df, dump_path, header: Union[List[int], List[str], bool] = True, spl
             df.columns = header
     elif isinstance(df, str):
         df = pd.DataFrame([df], columns=["text"])
+
+    if dedup_on:
+        dedup_on = [dedup_on] if isinstance(dedup_on, str) else list(dedup_on)
+        df, removed = dedup_frame(df, dedup_on)
+        print("[INFO] Dedup on {}, input rows: {}, removed rows: {}".format(dedup_on, len(df) + removed, removed))
     
     if split_num <= 0:
         dump_file(df, dump_path, header, cache_root, sep, doc_sep, url_on=url_on, sheet=sheet)
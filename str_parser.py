@@ -136,6 +136,34 @@ def str2dayno(x: str, mode: str = "patten") -> Union[str, List[str]]:
         raise Exception("Unknown mode='{}'".format(mode))
 
 
+def expand_braces(pattern: str) -> List[str]:
+    """
+    展开shell风格的花括号，支持嵌套，顺序与shell一致，没有花括号或括号内没有逗号时原样保留
+    :Examples
+        - expand_braces("a/2022112{6,7}/b{1,2}") = ['a/20221126/b1', 'a/20221126/b2', 'a/20221127/b1', 'a/20221127/b2']
+        - 常与str2dayno(x, mode="patten")配合使用
+    """
+    depth, start, commas = 0, None, []
+    for i, c in enumerate(pattern):
+        if c == "{":
+            if depth == 0:
+                start, commas = i, []
+            depth += 1
+        elif c == "," and depth == 1:
+            commas.append(i)
+        elif c == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                if not commas:
+                    # 没有逗号的{x}不展开，继续寻找后面的花括号
+                    return [pattern[:i + 1] + rest for rest in expand_braces(pattern[i + 1:])]
+                prefix, suffix = pattern[:start], pattern[i + 1:]
+                bounds = [start] + commas + [i]
+                options = [pattern[a + 1: b] for a, b in zip(bounds[:-1], bounds[1:])]
+                return [prefix + x for option in options for x in expand_braces(option + suffix)]
+    return [pattern]
+
+
 def make_simplified_name_function(name: str):
     return "".join([i[0] for i in name.split("_")])
 
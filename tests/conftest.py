@@ -0,0 +1,9 @@
+import os
+import sys
+import importlib.util
+
+# 仓库本身即utils包（模块间使用相对导入，parse_json_util使用from utils import），测试时按utils包名加载
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if "utils" not in sys.modules:
+    spec = importlib.util.spec_from_file_location("utils", os.path.join(root, "__init__.py"), submodule_search_locations=[root])
+    sys.modules["utils"] = importlib.util.module_from_spec(spec)
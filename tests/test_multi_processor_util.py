@@ -0,0 +1,80 @@
+import time
+
+from utils.multi_processor_util import parall_fun, HedgePolicy
+
+
+def test_hedge_does_not_wait_for_loser():
+    slow = set()
+
+    def fun(x):
+        if x == 50 and x not in slow:
+            slow.add(x)
+            time.sleep(3)
+        else:
+            time.sleep(0.01)
+        return x
+
+    policy = HedgePolicy(min_samples=10, max_extra=0.5)
+    start = time.monotonic()
+    res = parall_fun(fun, list(range(60)), 8, hedge=policy, progress=False)
+    assert res == list(range(60))
+    assert policy.stats["won"] >= 1
+    assert time.monotonic() - start < 1.5
+
+
+def square(x):
+    return x * x
+
+
+def test_single_process_pool_across_k():
+    from utils import multi_processor_util
+
+    max_processes = multi_processor_util.max_processes
+    multi_processor_util.shutdown_process_pools()
+    multi_processor_util.set_max_processes(8)
+    try:
+        for k in range(2, 9):
+            assert parall_fun(square, list(range(20)), k, backend="process") == [x * x for x in range(20)]
+        assert multi_processor_util.process_pool_size == 8
+        assert len(multi_processor_util.process_pool._processes) <= 8
+    finally:
+        multi_processor_util.set_max_processes(max_processes)
+        multi_processor_util.shutdown_process_pools()
+
+
+def test_object_array_with_warmed_pool():
+    import numpy as np
+
+    # 进程池先于object数组创建，对象指针不能通过共享内存传给子进程
+    assert parall_fun(abs, np.arange(4), 2, backend="process") == [0, 1, 2, 3]
+    inputs = np.array(["a", {"k": 1}, None, 3], dtype=object)
+    assert parall_fun(repr, inputs, 2, backend="process") == ["'a'", "{'k': 1}", "None", "3"]
+    assert parall_fun(len, np.array(["ab", "c"]), 2, backend="process") == [2, 1]
+    assert parall_fun(abs, np.arange(-3, 0), 2, backend="process") == [3, 2, 1]
+
+
+def test_is_throttled_error():
+    from utils.multi_processor_util import is_throttled_error
+
+    class StatusError(Exception):
+        status_code = 429
+
+    assert is_throttled_error(StatusError("boom"))
+    assert is_throttled_error(Exception("HTTP 429: slow down"))
+    assert is_throttled_error(Exception("Rate limit reached for requests"))
+    assert is_throttled_error(Exception("Too Many Requests"))
+    assert not is_throttled_error(KeyError("req_4291"))
+    assert not is_throttled_error(Exception("GET https://host/v1/item/14290 failed"))
+
+
+def test_pipeline_report_marks_single_bottleneck():
+    from utils.multi_processor_util import Stage, Pipeline, run_pipeline
+
+    lines = []
+    pipeline = Pipeline([Stage(lambda x: time.sleep(0.05) or x, 1), Stage(lambda x: x, 1)])
+    assert list(pipeline.run(range(5))) == list(range(5))
+    rows = pipeline.report(print_fun=lines.append)
+    assert [r["name"] for r in rows] == ["0:<lambda>", "1:<lambda>"]
+    assert sum("<- bottleneck" in line for line in lines) == 1
+    assert "<- bottleneck" in lines[0]
+    assert run_pipeline([(abs, 2)], [-1, -2]) == [1, 2]
@@ -0,0 +1,28 @@
+import time
+import threading
+
+from utils import pangu_util
+
+
+def test_stream_download_merge_bounds(tmp_path, monkeypatch):
+    lock, state = threading.Lock(), {"running": 0, "max_running": 0}
+
+    def fake_download(pangu_file, part_file):
+        with lock:
+            state["running"] += 1
+            state["max_running"] = max(state["max_running"], state["running"])
+        # 第0个part最慢，其余part下载完后在乱序缓存中等待
+        time.sleep(0.3 if pangu_file.endswith("/0") else 0.02)
+        with open(part_file, "w") as f:
+            f.write(pangu_file.split("/")[-1] + "\n")
+        with lock:
+            state["running"] -= 1
+
+    monkeypatch.setattr(pangu_util, "download_file", fake_download)
+    input_args = [["pangu://x/%d" % i, str(tmp_path / ("part-%03d" % i))] for i in range(40)]
+    local_file = str(tmp_path / "merged")
+    pangu_util.stream_download_merge(input_args, local_file, thread=8, reorder_buffer=4)
+    assert open(local_file).read().split() == [str(i) for i in range(40)]
+    # reorder_buffer只限制乱序缓存，不限制下载并发
+    assert state["max_running"] >= 5
+    assert state["max_running"] <= 8
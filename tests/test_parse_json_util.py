@@ -0,0 +1,23 @@
+import sqlite3
+
+import pandas as pd
+
+from utils import parse_json_util
+
+
+def test_parse_cache_persists_batch_with_workers(tmp_path):
+    disk_path = str(tmp_path / "parse_cache.db")
+    series = pd.Series(['{"a": %d, "b": "x"}' % i for i in range(400)] + ['{"a": 0, "b": "x"}', None])
+    cache = parse_json_util.enable_parse_cache(disk_path=disk_path)
+    try:
+        res = parse_json_util.parse_response_json_batch(series, ["a", "b"], workers=4)
+        assert res["a"].tolist()[:400] == list(range(400)) and res["a"].iloc[400] == 0
+        assert not res["succ"].iloc[-1]
+        assert cache.stats["misses"] == 400
+        with sqlite3.connect(disk_path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM parse_cache").fetchone()[0] == 400
+
+        res = parse_json_util.parse_response_json_batch(series, ["a", "b"], workers=4)
+        assert cache.stats["hits"] == 401
+    finally:
+        parse_json_util.disable_parse_cache()
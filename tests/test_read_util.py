@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+
+from utils import read_util
+
+
+def test_dedup_on_dtype_drift_across_shards(tmp_path):
+    # s2的v列含空值，会被读成float64，和s1的int64值需要判为重复
+    s1, s2 = str(tmp_path / "s1.tsv"), str(tmp_path / "s2.tsv")
+    pd.DataFrame({"v": [1, 2]}).to_csv(s1, sep="\t", index=False)
+    pd.DataFrame({"v": [1.0, np.nan]}).to_csv(s2, sep="\t", index=False)
+    df = read_util.read_df([s1, s2], dedup_on=["v"], cache_root=str(tmp_path / ".cache"))
+    assert df["v"].tolist()[:2] == [1, 2]
+    assert len(df) == 3 and df["v"].isna().sum() == 1
+
+
+def test_dedup_frame_keeps_first():
+    df = pd.DataFrame({"q": ["a", "b", "a", None, None], "x": [1, 2, 3, 4, 5]})
+    res, removed = read_util.dedup_frame(df, ["q"])
+    assert res["x"].tolist() == [1, 2, 4] and removed == 2
+
+
+def test_globs_days_skips_missing_partitions(tmp_path, monkeypatch):
+    def fake_glob(path_pattern):
+        if "20240102" in path_pattern:
+            raise FileNotFoundError(path_pattern)
+        return [path_pattern.replace("*", "0")]
+
+    monkeypatch.setattr(read_util, "glob_single", fake_glob)
+    paths = read_util.globs_days("pangu://x/dt={dayno}/part-*", "20240101~20240103", work_num=2)
+    assert paths == ["pangu://x/dt=20240101/part-0", "pangu://x/dt=20240103/part-0"]